@@ -22,6 +22,7 @@ from aiohttp import web
 import aiohttp
 import os
 import json
+import orjson
 import logging
 import asyncio
 from datetime import datetime
@@ -372,9 +373,10 @@ def _make_event_handler(event_name: str):
         if body is None:
             body = await request.read()
 
-        # Tenta decodificar como JSON; em caso de erro, devolve conteúdo textual
+        # Tenta decodificar como JSON direto do buffer (sem decode/cópia);
+        # em caso de erro, devolve conteúdo textual
         try:
-            payload = json.loads(body.decode() or "null")
+            payload = orjson.loads(body) if body else None
         except Exception:
             payload = {"raw": body.decode(errors="ignore")}
 
@@ -0,0 +1,391 @@
+"""
+Utilitários compartilhados pelos scripts de diagnóstico da API GHL.
+
+O ponto de entrada é ghl_client(), que entrega um cliente já configurado
+(sessão compartilhada + retry + cache + limite de concorrência + logger):
+
+    async with ghl_client() as client:
+        response = await client.get(url, headers=ghl_headers(PIT))
+
+Usado por:
+- test_pagination_methods.py
+- test_pit_detailed.py
+- test_pit_with_location.py
+- test_pit_token.py
+"""
+
+import asyncio
+import logging
+import logging.handlers
+import os
+import random
+import sys
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Hashable, List, Optional, Sequence, Tuple, Union
+
+import aiohttp
+import httpx
+import orjson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import brotli  # noqa: F401  (aiohttp/httpx só decodificam "br" com ele instalado)
+    _ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    _ACCEPT_ENCODING = "gzip, deflate"
+
+try:
+    import h2  # noqa: F401  (necessário para http2=True no httpx)
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+GHL_API_URL = "https://services.leadconnectorhq.com"
+GHL_API_VERSION = "2021-07-28"
+
+# PIT token master (do .env)
+PIT = os.getenv("PIT")
+
+# Headers enviados em toda requisição (respostas JSON comprimem muito bem)
+COMMON_HEADERS = {"Accept-Encoding": _ACCEPT_ENCODING}
+
+# Cliente HTTP dos probes: httpx (HTTP/2) por padrão, aiohttp como fallback
+ProbeSession = Union[httpx.AsyncClient, aiohttp.ClientSession]
+
+# Erros de transporte que disparam retry (e que os scripts podem tratar)
+TRANSPORT_ERRORS = (aiohttp.ClientError, httpx.TransportError, asyncio.TimeoutError)
+
+
+@dataclass(frozen=True)
+class ProbeResponse:
+    """Resposta HTTP já lida (o corpo sobrevive ao fechamento da conexão)."""
+
+    status: int
+    body: bytes
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return orjson.loads(self.body)
+
+
+class ProbeHTTPError(RuntimeError):
+    """Resposta não-200 onde o probe precisava de sucesso (ex.: paginação)."""
+
+    def __init__(self, response: ProbeResponse, url: str):
+        self.response = response
+        self.status = response.status
+        super().__init__(f"HTTP {response.status} em {url}: {response.text[:200]}")
+
+
+def probe_logger(name: str = "probe") -> logging.Logger:
+    """
+    Logger dos scripts de probe, com saída bufferizada.
+
+    As mensagens ficam num MemoryHandler e só vão para o stdout em
+    flush_output() (ou ao encher o buffer / no encerramento do processo),
+    evitando um write no terminal por linha impressa.
+    """
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        target = logging.StreamHandler(sys.stdout)
+        target.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(logging.handlers.MemoryHandler(capacity=1000, target=target))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def flush_output(name: str = "probe"):
+    """Descarrega no stdout as mensagens acumuladas pelo probe_logger."""
+    for handler in logging.getLogger(name).handlers:
+        handler.flush()
+
+
+class ResponseLRU:
+    """Cache LRU em memória de respostas GET já lidas."""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, ProbeResponse]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[ProbeResponse]:
+        response = self._data.get(key)
+        if response is not None:
+            self._data.move_to_end(key)
+        return response
+
+    def put(self, key: Hashable, response: ProbeResponse):
+        self._data[key] = response
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+_response_cache: Optional[ResponseLRU] = ResponseLRU()
+
+
+def disable_cache():
+    """Desliga o cache de respostas (flag --no-cache dos scripts)."""
+    global _response_cache
+    _response_cache = None
+
+
+def _cache_key(method: str, url: str, kwargs: Dict[str, Any]) -> Hashable:
+    headers = kwargs.get("headers") or {}
+    params = kwargs.get("params") or {}
+    return (
+        method.upper(),
+        url,
+        tuple(sorted(headers.items())),
+        tuple(sorted((k, str(v)) for k, v in params.items())),
+    )
+
+
+def _orjson_dumps(obj: Any) -> str:
+    return orjson.dumps(obj).decode()
+
+
+def create_session(backend: str = "httpx") -> ProbeSession:
+    """
+    Cria o cliente HTTP configurado para a API GHL.
+
+    backend="httpx" (padrão): httpx.AsyncClient com HTTP/2 quando o pacote
+    h2 está instalado, multiplexando todas as requisições ao mesmo host
+    numa única conexão TLS.
+
+    backend="aiohttp": sessão aiohttp com cache de DNS (5 min), happy
+    eyeballs entre IPv4/IPv6 e conexões keep-alive.
+
+    Em ambos: compressão habilitada e JSON via orjson.
+    """
+    if backend == "httpx":
+        return httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            headers=COMMON_HEADERS,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            timeout=30.0,
+        )
+    if backend != "aiohttp":
+        raise ValueError(f"backend desconhecido: {backend}")
+
+    connector = aiohttp.TCPConnector(
+        limit=64,
+        limit_per_host=64,
+        use_dns_cache=True,
+        ttl_dns_cache=300,
+        happy_eyeballs_delay=0.25,
+        keepalive_timeout=75,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers=COMMON_HEADERS,
+        json_serialize=_orjson_dumps,
+    )
+
+
+async def _send(session: ProbeSession, method: str, url: str, **kwargs) -> ProbeResponse:
+    """Adaptador: executa uma requisição em httpx ou aiohttp."""
+    if isinstance(session, httpx.AsyncClient):
+        if "json" in kwargs:
+            headers = dict(kwargs.get("headers") or {})
+            headers.setdefault("Content-Type", "application/json")
+            kwargs["headers"] = headers
+            kwargs["content"] = orjson.dumps(kwargs.pop("json"))
+        response = await session.request(method, url, **kwargs)
+        return ProbeResponse(response.status_code, response.content)
+
+    async with session.request(method, url, **kwargs) as response:
+        return ProbeResponse(response.status, await response.read())
+
+
+async def request_with_retry(
+    session: ProbeSession,
+    method: str,
+    url: str,
+    tries: int = 5,
+    base: float = 0.25,
+    **kwargs
+) -> ProbeResponse:
+    """
+    Faz requisição com retry exponential backoff + jitter.
+
+    Repete em erros de conexão/timeout, 429 e 5xx. Na última tentativa
+    devolve a resposta como veio (ou propaga a exceção).
+
+    GETs idênticos (mesma URL, headers e params) são servidos do cache
+    LRU em memória, a menos que disable_cache() tenha sido chamado.
+
+    Args:
+        session: Cliente criado por create_session()
+        method: Método HTTP
+        url: URL completa
+        tries: Número máximo de tentativas
+        base: Espera base (segundos) do backoff
+        **kwargs: Repassados para a requisição (headers, params, json...)
+
+    Returns:
+        ProbeResponse com status e corpo
+    """
+    cache = _response_cache if method.upper() == "GET" else None
+    if cache is not None:
+        key = _cache_key(method, url, kwargs)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    for attempt in range(tries):
+        last = attempt == tries - 1
+        try:
+            result = await _send(session, method, url, **kwargs)
+            retryable = result.status >= 500 or result.status == 429
+            if not retryable and cache is not None:
+                cache.put(key, result)
+            if not retryable or last:
+                return result
+        except TRANSPORT_ERRORS:
+            if last:
+                raise
+
+        await asyncio.sleep((2 ** attempt) * base + random.random() * 0.1)
+
+    raise RuntimeError("tries deve ser >= 1")
+
+
+def ghl_headers(token: Optional[str], version: Optional[str] = GHL_API_VERSION, **extra: str) -> Dict[str, str]:
+    """Monta os headers de autenticação da API GHL (version=None omite Version)."""
+    headers = {"Authorization": f"Bearer {token}"}
+    if version:
+        headers["Version"] = version
+    headers.update(extra)
+    return headers
+
+
+class GHLClient:
+    """Cliente dos probes: sessão compartilhada + retry + cache + limite de concorrência."""
+
+    def __init__(self, session: ProbeSession, max_concurrency: int = 8):
+        self.session = session
+        self.logger = probe_logger()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def request(self, method: str, url: str, **kwargs) -> ProbeResponse:
+        async with self._semaphore:
+            return await request_with_retry(self.session, method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> ProbeResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> ProbeResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> ProbeResponse:
+        return await self.request("DELETE", url, **kwargs)
+
+
+@asynccontextmanager
+async def ghl_client(backend: str = "httpx", max_concurrency: int = 8) -> AsyncIterator[GHLClient]:
+    """
+    Fixture dos probes: abre a sessão, entrega o GHLClient e, ao sair,
+    fecha a sessão e descarrega o output bufferizado.
+    """
+    async with create_session(backend) as session:
+        try:
+            yield GHLClient(session, max_concurrency=max_concurrency)
+        finally:
+            flush_output()
+
+
+async def paginate_contacts(
+    client: GHLClient,
+    location_id: str,
+    headers: Dict[str, str],
+    page_size: int = 100
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Itera contatos da location de forma lazy (paginação keyset).
+
+    A próxima página é buscada em background enquanto o consumidor
+    processa a atual, então só há no máximo duas páginas em memória.
+
+    Uma página que não volte 200 (401, 422, 5xx após os retries) levanta
+    ProbeHTTPError, para não ser confundida com o fim dos dados.
+
+    Uso:
+        async for contact in paginate_contacts(client, location_id, headers):
+            ...
+    """
+    url = f"{GHL_API_URL}/contacts/"
+
+    async def fetch_page(cursor: Optional[Tuple[Any, str]]) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"locationId": location_id, "limit": page_size}
+        if cursor:
+            params["startAfter"], params["startAfterId"] = cursor
+        response = await client.get(url, headers=headers, params=params)
+        if response.status != 200:
+            raise ProbeHTTPError(response, url)
+        return response.json()
+
+    pending = asyncio.create_task(fetch_page(None))
+    try:
+        while pending is not None:
+            data = await pending
+            pending = None
+
+            contacts = data.get("contacts", [])
+            meta = data.get("meta", {})
+            start_after = meta.get("startAfter")
+            start_after_id = meta.get("startAfterId")
+
+            # Prefetch da próxima página antes de entregar a atual
+            if contacts and start_after and start_after_id:
+                pending = asyncio.create_task(fetch_page((start_after, start_after_id)))
+
+            for contact in contacts:
+                yield contact
+    finally:
+        if pending is not None:
+            if not pending.done():
+                pending.cancel()
+            elif not pending.cancelled():
+                pending.exception()  # prefetch já falhou; o consumidor parou antes
+
+
+class AsyncBatcher(ABC):
+    """
+    Processa itens em lotes de até max_batch_size.
+
+    Subclasses implementam process_batch (ex.: um asyncio.gather sobre o
+    lote) e devolvem um resultado por item, na mesma ordem. Sem ele, a
+    subclasse falha já ao ser instanciada (TypeError).
+    """
+
+    def __init__(self, max_batch_size: int = 8, batch_interval: float = 0.0):
+        """
+        Args:
+            max_batch_size: Itens processados simultaneamente por lote
+            batch_interval: Pausa (segundos) entre lotes, para rate limiting
+        """
+        self.max_batch_size = max_batch_size
+        self.batch_interval = batch_interval
+
+    @abstractmethod
+    async def process_batch(self, batch: List[Any]) -> List[Any]:
+        """Processa um lote e devolve um resultado por item, na mesma ordem."""
+
+    async def run(self, items: Sequence[Any]) -> List[Any]:
+        """Processa todos os itens e retorna os resultados na ordem de entrada."""
+        results: List[Any] = []
+        for start in range(0, len(items), self.max_batch_size):
+            if start and self.batch_interval:
+                await asyncio.sleep(self.batch_interval)
+            batch = list(items[start:start + self.max_batch_size])
+            results.extend(await self.process_batch(batch))
+        return results
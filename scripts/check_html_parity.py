@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Confere se os dois parsers HTML do detector two-pass extraem o mesmo
+conteúdo dos emails coletados.
+
+O detector usa selectolax (Lexbor) quando instalado e BeautifulSoup como
+fallback. As features (e portanto as regras rápidas) dependem só de
+(texto visível, hrefs, tamanhos de <img>), então basta os dois backends
+concordarem nessas três saídas.
+
+Uso:
+    python scripts/check_html_parity.py [--limit N] [--show N]
+
+Requer selectolax e beautifulsoup4 instalados. Sai com código 1 se
+algum email divergir.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Iterator, Tuple
+import logging
+import ijson
+
+# Adicionar diretório raiz ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils import two_pass_detector
+from utils.two_pass_detector import _parse_html_bs4, _parse_html_lexbor
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+MESSAGES_FILE = Path("data/spam_conversations/messages_with_bodies.json")
+
+
+def iter_bodies(limit: int) -> Iterator[Tuple[str, str]]:
+    """Itera (msg_id, body) das mensagens coletadas, em streaming."""
+    with open(MESSAGES_FILE, "rb") as f:
+        for count, (msg_id, message) in enumerate(ijson.kvitems(f, "messages", use_float=True)):
+            if limit and count >= limit:
+                break
+            body = message.get("body") or message.get("email_data", {}).get("body", "")
+            if body:
+                yield msg_id, body
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compara o parse HTML do selectolax com o do BeautifulSoup.")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=0,
+        help="Máximo de mensagens a conferir (0 = todas)",
+    )
+    parser.add_argument(
+        "--show",
+        type=int,
+        default=5,
+        help="Quantas divergências detalhar no log (padrão: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    if two_pass_detector.LexborHTMLParser is None or two_pass_detector.BeautifulSoup is None:
+        logging.error("❌ É preciso ter selectolax e beautifulsoup4 instalados")
+        return 2
+
+    checked = 0
+    mismatches = 0
+    for msg_id, body in iter_bodies(args.limit):
+        checked += 1
+        lexbor = _parse_html_lexbor(body)
+        bs4 = _parse_html_bs4(body)
+        if lexbor == bs4:
+            continue
+
+        mismatches += 1
+        if mismatches <= args.show:
+            for name, a, b in zip(("texto", "hrefs", "imgs"), lexbor, bs4):
+                if a != b:
+                    logging.warning(f"  {msg_id}: {name} difere")
+                    logging.warning(f"    lexbor: {str(a)[:200]!r}")
+                    logging.warning(f"    bs4:    {str(b)[:200]!r}")
+
+    logging.info(f"📊 {checked} emails conferidos, {mismatches} divergentes")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
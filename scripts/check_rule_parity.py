@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Confere se a cascata escalar das regras rápidas (apply_fast_rules) e a
+vetorizada (classify_batch) escolhem a mesma regra.
+
+Gera features sintéticas exatamente no limiar e logo acima de cada regra,
+combinadas com os três casos de subject (nenhum, DMARC, currículo), e
+compara o id da regra nos dois caminhos.
+
+Uso:
+    python scripts/check_rule_parity.py
+
+Sai com código 1 se algum caso divergir.
+"""
+
+import itertools
+import sys
+from pathlib import Path
+from typing import List
+import logging
+
+# Adicionar diretório raiz ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils import two_pass_detector as tpd
+from utils.two_pass_detector import Features
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def probe_features() -> List[Features]:
+    """Features sintéticas nos limiares de cada regra."""
+    probes = []
+    for url_count, img_count, tracking, ratio, keywords, caps, preview_len, subject in itertools.product(
+        sorted({
+            0,
+            tpd._R5_MIN_URLS, tpd._R5_MIN_URLS + 1,
+            tpd._R3_MIN_URLS, tpd._R3_MIN_URLS + 1,
+            tpd._R2_MIN_URLS, tpd._R2_MIN_URLS + 1,
+        }),
+        (tpd._R3_MIN_IMGS, tpd._R3_MIN_IMGS + 1),
+        (0, tpd._R2_MIN_TRACKING, tpd._R2_MIN_TRACKING + 1),
+        (float(tpd._R5_MIN_HTML_RATIO), tpd._R5_MIN_HTML_RATIO + 0.5),
+        (0, tpd._R3_MIN_KEYWORDS, tpd._R3_MIN_KEYWORDS + 1),
+        (tpd._R7_MIN_CAPS_RATIO, tpd._R7_MIN_CAPS_RATIO + 0.01),
+        (tpd._R7_MIN_PREVIEW_LEN, tpd._R7_MIN_PREVIEW_LEN + 1),
+        ("", "DMARC report", "cv joão"),
+    ):
+        probes.append(Features(
+            url_count=url_count,
+            img_count=img_count,
+            unique_domains=0,
+            tracking_pixel_count=tracking,
+            html_text_ratio=ratio,
+            spam_keyword_count=keywords,
+            caps_ratio=caps,
+            exclamation_count=0,
+            subject=subject,
+            text_preview="x" * preview_len,
+        ))
+    return probes
+
+
+def main() -> int:
+    probes = probe_features()
+    batch_ids = tpd._rule_ids_batch(probes)
+
+    mismatches = 0
+    for features, batch_id in zip(probes, batch_ids):
+        scalar_id = tpd._rule_id(features)
+        if scalar_id != int(batch_id):
+            mismatches += 1
+            logging.warning(f"  escalar={scalar_id} lote={int(batch_id)}: {features}")
+
+    logging.info(f"📊 {len(probes)} casos conferidos, {mismatches} divergentes")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,6 +22,7 @@ import asyncio
 import json
 import logging
 import sys
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Any, Optional
@@ -446,17 +447,22 @@ def load_location_token() -> tuple[str, str]:
     expires_at = token_data.get("expires_at")
     if expires_at:
         try:
-            from dateutil import parser
-            expiry = parser.isoparse(expires_at)
-            now = datetime.now(expiry.tzinfo)
+            if isinstance(expires_at, (int, float)):
+                # Formato atual do ghl-oauth: Unix epoch (segundos)
+                remaining_s = expires_at - time.time()
+            else:
+                # Formato legado: string ISO
+                from dateutil import parser
+                expiry = parser.isoparse(expires_at)
+                remaining_s = (expiry - datetime.now(expiry.tzinfo)).total_seconds()
 
-            if now >= expiry:
+            if remaining_s <= 0:
                 logging.error("❌ Token expirado!")
                 logging.error(f"   Expirou em: {expires_at}")
                 logging.error("   Execute 'ghl-oauth' para renovar o token.")
                 sys.exit(1)
 
-            remaining = (expiry - now).total_seconds() / 3600
+            remaining = remaining_s / 3600
             logging.info(f"✅ Token válido (expira em {remaining:.1f}h)")
         except Exception:
             logging.warning("⚠️  Não foi possível verificar expiração do token")
@@ -4,238 +4,219 @@ Testa diferentes métodos de paginação da API GHL.
 """
 
 import asyncio
-import aiohttp
-import json
 import os
+import sys
+from types import MappingProxyType
 
+import orjson
 
-TOKEN = "pit-b3d6fd3f-2b7d-4c85-981b-8772d97f4597"
-LOCATION_ID = "Wc3wencAfbxKbynASybx"
+from _ghl_probe import (
+    disable_cache,
+    flush_output,
+    GHL_API_URL,
+    GHLClient,
+    ghl_client,
+    ghl_headers,
+    paginate_contacts,
+    PIT,
+    probe_logger,
+    ProbeHTTPError,
+)
+
+logger = probe_logger()
 
 
-async def test_method_1_startAfterId():
-    """Método atual: usando startAfterId."""
-    print("\n" + "="*70)
-    print("TESTE 1: Paginação com startAfterId (método atual)")
-    print("="*70)
-
-    async with aiohttp.ClientSession() as session:
-        url = "https://services.leadconnectorhq.com/contacts/"
-        headers = {
-            "Authorization": f"Bearer {TOKEN}",
-            "Version": "2021-07-28",
-            "Accept": "application/json"
-        }
-
-        # Página 1
-        params = {"locationId": LOCATION_ID, "limit": 10}
-        async with session.get(url, headers=headers, params=params) as response:
-            page1 = await response.json()
-            print(f"\nPágina 1:")
-            print(f"  Status: {response.status}")
-            print(f"  Contatos: {len(page1.get('contacts', []))}")
-            if page1.get('contacts'):
-                print(f"  Primeiro ID: {page1['contacts'][0]['id']}")
-                print(f"  Último ID: {page1['contacts'][-1]['id']}")
-            print(f"  meta.startAfterId: {page1.get('meta', {}).get('startAfterId')}")
-            print(f"  meta.startAfter: {page1.get('meta', {}).get('startAfter')}")
-            print(f"  meta.nextPageUrl: {page1.get('meta', {}).get('nextPageUrl')}")
-
-        # Página 2 usando startAfterId
-        start_after_id = page1.get('meta', {}).get('startAfterId')
-        if start_after_id:
-            params = {"locationId": LOCATION_ID, "limit": 10, "startAfterId": start_after_id}
-            async with session.get(url, headers=headers, params=params) as response:
-                page2 = await response.json()
-                print(f"\nPágina 2 (com startAfterId={start_after_id}):")
-                print(f"  Status: {response.status}")
-                print(f"  Contatos: {len(page2.get('contacts', []))}")
-                if page2.get('contacts'):
-                    print(f"  Primeiro ID: {page2['contacts'][0]['id']}")
-                    print(f"  Último ID: {page2['contacts'][-1]['id']}")
-
-                    # Verificar se são os mesmos IDs
-                    page1_ids = {c['id'] for c in page1['contacts']}
-                    page2_ids = {c['id'] for c in page2['contacts']}
-                    overlap = page1_ids & page2_ids
-                    print(f"  IDs duplicados com página 1: {len(overlap)}/{len(page2_ids)}")
-
-
-async def test_method_2_startAfter():
+LOCATION_ID = "Wc3wencAfbxKbynASybx"
+
+CONTACTS_URL = f"{GHL_API_URL}/contacts/"
+SEARCH_URL = f"{GHL_API_URL}/contacts/search"
+
+# Headers/params constantes, montados uma única vez (PIT vem do .env)
+HEADERS_V1 = ghl_headers(PIT, Accept="application/json")
+SEARCH_HEADERS = ghl_headers(PIT, Accept="application/json", **{"Content-Type": "application/json"})
+
+VERSIONS = ["2021-07-28", "2021-04-15", "2020-10-06"]
+HEADERS_BY_VERSION = {v: ghl_headers(PIT, version=v, Accept="application/json") for v in VERSIONS}
+
+PAGE_PARAMS = MappingProxyType({"locationId": LOCATION_ID, "limit": 10})
+INSPECT_PARAMS = MappingProxyType({"locationId": LOCATION_ID, "limit": 5})
+SEARCH_BODY = {"locationId": LOCATION_ID, "limit": 10}
+
+
+async def test_method_1_startAfterId(client: GHLClient):
+    """Método atual: keyset (startAfter=timestamp + startAfterId)."""
+    logger.info("\n" + "="*70)
+    logger.info("TESTE 1: Paginação keyset com startAfter + startAfterId (método atual)")
+    logger.info("="*70)
+
+    # Página 1
+    response = await client.get(CONTACTS_URL, headers=HEADERS_V1, params=PAGE_PARAMS)
+    page1 = response.json()
+    logger.info(f"\nPágina 1:")
+    logger.info(f"  Status: {response.status}")
+    logger.info(f"  Contatos: {len(page1.get('contacts', []))}")
+    if page1.get('contacts'):
+        logger.info(f"  Primeiro ID: {page1['contacts'][0]['id']}")
+        logger.info(f"  Último ID: {page1['contacts'][-1]['id']}")
+    logger.info(f"  meta.startAfterId: {page1.get('meta', {}).get('startAfterId')}")
+    logger.info(f"  meta.startAfter: {page1.get('meta', {}).get('startAfter')}")
+    logger.info(f"  meta.nextPageUrl: {page1.get('meta', {}).get('nextPageUrl')}")
+
+    # Página 2 usando o cursor keyset completo (dateAdded em ms, id)
+    meta = page1.get('meta', {})
+    start_after = meta.get('startAfter')
+    start_after_id = meta.get('startAfterId')
+    if start_after and start_after_id:
+        params = {**PAGE_PARAMS, "startAfter": start_after, "startAfterId": start_after_id}
+        response = await client.get(CONTACTS_URL, headers=HEADERS_V1, params=params)
+        page2 = response.json()
+        logger.info(f"\nPágina 2 (com startAfter={start_after}, startAfterId={start_after_id}):")
+        logger.info(f"  Status: {response.status}")
+        logger.info(f"  Contatos: {len(page2.get('contacts', []))}")
+        if page2.get('contacts'):
+            logger.info(f"  Primeiro ID: {page2['contacts'][0]['id']}")
+            logger.info(f"  Último ID: {page2['contacts'][-1]['id']}")
+
+            # Verificar se são os mesmos IDs (um lookup por contato, sem 2º set)
+            page1_ids = frozenset(c['id'] for c in page1['contacts'])
+            overlap = sum(1 for c in page2['contacts'] if c['id'] in page1_ids)
+            logger.info(f"  IDs duplicados com página 1: {overlap}/{len(page2['contacts'])}")
+            assert overlap == 0, "Cursor keyset retornou contatos repetidos"
+
+
+async def test_method_2_startAfter(client: GHLClient):
     """Teste: usando startAfter (sem Id)."""
-    print("\n" + "="*70)
-    print("TESTE 2: Paginação com startAfter (sem Id)")
-    print("="*70)
-
-    async with aiohttp.ClientSession() as session:
-        url = "https://services.leadconnectorhq.com/contacts/"
-        headers = {
-            "Authorization": f"Bearer {TOKEN}",
-            "Version": "2021-07-28",
-            "Accept": "application/json"
-        }
-
-        # Página 1
-        params = {"locationId": LOCATION_ID, "limit": 10}
-        async with session.get(url, headers=headers, params=params) as response:
-            page1 = await response.json()
-
-        # Página 2 usando último ID como startAfter
-        last_id = page1['contacts'][-1]['id']
-        params = {"locationId": LOCATION_ID, "limit": 10, "startAfter": last_id}
-        async with session.get(url, headers=headers, params=params) as response:
-            page2 = await response.json()
-            print(f"\nUsando startAfter={last_id}:")
-            print(f"  Status: {response.status}")
-            print(f"  Contatos: {len(page2.get('contacts', []))}")
-            if page2.get('contacts'):
-                page1_ids = {c['id'] for c in page1['contacts']}
-                page2_ids = {c['id'] for c in page2['contacts']}
-                overlap = page1_ids & page2_ids
-                print(f"  IDs duplicados com página 1: {len(overlap)}/{len(page2_ids)}")
-
-
-async def test_method_3_query_param():
-    """Teste: usando query ou outros parâmetros."""
-    print("\n" + "="*70)
-    print("TESTE 3: Outros parâmetros de paginação")
-    print("="*70)
-
-    async with aiohttp.ClientSession() as session:
-        url = "https://services.leadconnectorhq.com/contacts/"
-        headers = {
-            "Authorization": f"Bearer {TOKEN}",
-            "Version": "2021-07-28",
-            "Accept": "application/json"
-        }
-
-        # Tentar com offset
-        print("\nTestando com offset=10:")
-        params = {"locationId": LOCATION_ID, "limit": 10, "offset": 10}
-        async with session.get(url, headers=headers, params=params) as response:
-            result = await response.json()
-            print(f"  Status: {response.status}")
-            if response.status == 200:
-                print(f"  Contatos: {len(result.get('contacts', []))}")
-            else:
-                print(f"  Erro: {result}")
-
-        # Tentar com page
-        print("\nTestando com page=2:")
-        params = {"locationId": LOCATION_ID, "limit": 10, "page": 2}
-        async with session.get(url, headers=headers, params=params) as response:
-            result = await response.json()
-            print(f"  Status: {response.status}")
-            if response.status == 200:
-                print(f"  Contatos: {len(result.get('contacts', []))}")
-            else:
-                print(f"  Erro: {result}")
-
-
-async def test_method_4_search_endpoint():
+    logger.info("\n" + "="*70)
+    logger.info("TESTE 2: Paginação com startAfter (sem Id)")
+    logger.info("="*70)
+
+    # Página 1
+    response = await client.get(CONTACTS_URL, headers=HEADERS_V1, params=PAGE_PARAMS)
+    page1 = response.json()
+
+    # Página 2 usando último ID como startAfter
+    last_id = page1['contacts'][-1]['id']
+    params = {**PAGE_PARAMS, "startAfter": last_id}
+    response = await client.get(CONTACTS_URL, headers=HEADERS_V1, params=params)
+    page2 = response.json()
+    logger.info(f"\nUsando startAfter={last_id}:")
+    logger.info(f"  Status: {response.status}")
+    logger.info(f"  Contatos: {len(page2.get('contacts', []))}")
+    if page2.get('contacts'):
+        page1_ids = frozenset(c['id'] for c in page1['contacts'])
+        overlap = sum(1 for c in page2['contacts'] if c['id'] in page1_ids)
+        logger.info(f"  IDs duplicados com página 1: {overlap}/{len(page2['contacts'])}")
+
+
+async def test_method_4_search_endpoint(client: GHLClient):
     """Teste: usando endpoint /contacts/search."""
-    print("\n" + "="*70)
-    print("TESTE 4: Endpoint /contacts/search")
-    print("="*70)
-
-    async with aiohttp.ClientSession() as session:
-        url = "https://services.leadconnectorhq.com/contacts/search"
-        headers = {
-            "Authorization": f"Bearer {TOKEN}",
-            "Version": "2021-07-28",
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        }
-
-        # Página 1
-        body = {
-            "locationId": LOCATION_ID,
-            "limit": 10
-        }
-        async with session.post(url, headers=headers, json=body) as response:
-            print(f"\nPágina 1 (POST /contacts/search):")
-            print(f"  Status: {response.status}")
-            if response.status == 200:
-                page1 = await response.json()
-                print(f"  Contatos: {len(page1.get('contacts', []))}")
-                if page1.get('contacts'):
-                    print(f"  Primeiro ID: {page1['contacts'][0]['id']}")
-                    print(f"  Response keys: {list(page1.keys())}")
-            else:
-                text = await response.text()
-                print(f"  Erro: {text}")
-
-
-async def test_method_5_inspect_response():
+    logger.info("\n" + "="*70)
+    logger.info("TESTE 4: Endpoint /contacts/search")
+    logger.info("="*70)
+
+    # Página 1
+    response = await client.post(SEARCH_URL, headers=SEARCH_HEADERS, json=SEARCH_BODY)
+    logger.info(f"\nPágina 1 (POST /contacts/search):")
+    logger.info(f"  Status: {response.status}")
+    if response.status == 200:
+        page1 = response.json()
+        logger.info(f"  Contatos: {len(page1.get('contacts', []))}")
+        if page1.get('contacts'):
+            logger.info(f"  Primeiro ID: {page1['contacts'][0]['id']}")
+            logger.info(f"  Response keys: {list(page1.keys())}")
+    else:
+        logger.info(f"  Erro: {response.text}")
+
+
+async def test_method_5_inspect_response(client: GHLClient):
     """Inspecionar completamente a resposta da API."""
-    print("\n" + "="*70)
-    print("TESTE 5: Inspeção completa da resposta")
-    print("="*70)
-
-    async with aiohttp.ClientSession() as session:
-        url = "https://services.leadconnectorhq.com/contacts/"
-        headers = {
-            "Authorization": f"Bearer {TOKEN}",
-            "Version": "2021-07-28",
-            "Accept": "application/json"
-        }
-
-        params = {"locationId": LOCATION_ID, "limit": 5}
-        async with session.get(url, headers=headers, params=params) as response:
-            result = await response.json()
-            print(f"\nResposta completa da API:")
-            print(json.dumps(result, indent=2))
-
-
-async def test_method_6_different_versions():
+    logger.info("\n" + "="*70)
+    logger.info("TESTE 5: Inspeção completa da resposta")
+    logger.info("="*70)
+
+    response = await client.get(CONTACTS_URL, headers=HEADERS_V1, params=INSPECT_PARAMS)
+    result = response.json()
+    logger.info(f"\nResposta completa da API:")
+    logger.info(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
+
+
+async def test_method_6_different_versions(client: GHLClient):
     """Teste: versões diferentes da API."""
-    print("\n" + "="*70)
-    print("TESTE 6: Versões diferentes da API")
-    print("="*70)
-
-    versions = ["2021-07-28", "2021-04-15", "2020-10-06"]
-
-    async with aiohttp.ClientSession() as session:
-        url = "https://services.leadconnectorhq.com/contacts/"
-
-        for version in versions:
-            headers = {
-                "Authorization": f"Bearer {TOKEN}",
-                "Version": version,
-                "Accept": "application/json"
-            }
-
-            params = {"locationId": LOCATION_ID, "limit": 5}
-            async with session.get(url, headers=headers, params=params) as response:
-                print(f"\nVersão {version}:")
-                print(f"  Status: {response.status}")
-                if response.status == 200:
-                    result = await response.json()
-                    print(f"  Contatos: {len(result.get('contacts', []))}")
-                    print(f"  Keys na resposta: {list(result.keys())}")
-                    if 'meta' in result:
-                        print(f"  Keys em meta: {list(result['meta'].keys())}")
+    logger.info("\n" + "="*70)
+    logger.info("TESTE 6: Versões diferentes da API")
+    logger.info("="*70)
+
+    # Versões independentes: disparar todas em paralelo e imprimir na ordem
+    responses = await asyncio.gather(*(
+        client.get(CONTACTS_URL, headers=HEADERS_BY_VERSION[version], params=INSPECT_PARAMS)
+        for version in VERSIONS
+    ))
+
+    for version, response in zip(VERSIONS, responses):
+        logger.info(f"\nVersão {version}:")
+        logger.info(f"  Status: {response.status}")
+        if response.status == 200:
+            result = response.json()
+            logger.info(f"  Contatos: {len(result.get('contacts', []))}")
+            logger.info(f"  Keys na resposta: {list(result.keys())}")
+            if 'meta' in result:
+                logger.info(f"  Keys em meta: {list(result['meta'].keys())}")
+
+
+async def test_method_7_async_generator(client: GHLClient, max_contacts: int = 30):
+    """Teste: paginação lazy via async generator (com prefetch)."""
+    logger.info("\n" + "="*70)
+    logger.info("TESTE 7: Async generator paginate_contacts (page_size=10)")
+    logger.info("="*70)
+
+    seen_ids = set()
+    duplicates = 0
+    try:
+        async for contact in paginate_contacts(client, LOCATION_ID, HEADERS_V1, page_size=10):
+            if contact['id'] in seen_ids:
+                duplicates += 1
+            seen_ids.add(contact['id'])
+            if len(seen_ids) + duplicates >= max_contacts:
+                break
+    except ProbeHTTPError as e:
+        logger.info(f"  ❌ Paginação interrompida: {e}")
+
+    logger.info(f"\n  Contatos recebidos: {len(seen_ids) + duplicates}")
+    logger.info(f"  IDs únicos: {len(seen_ids)}")
+    logger.info(f"  IDs duplicados: {duplicates}")
 
 
 async def main():
     """Executa todos os testes."""
-    print("""
+    logger.info("""
 ╔══════════════════════════════════════════════════════════════════════╗
 ║          Teste de Métodos de Paginação - GHL API                    ║
 ╚══════════════════════════════════════════════════════════════════════╝
 """)
 
-    await test_method_1_startAfterId()
-    await test_method_2_startAfter()
-    await test_method_3_query_param()
-    await test_method_4_search_endpoint()
-    await test_method_5_inspect_response()
-    await test_method_6_different_versions()
+    tests = [
+        test_method_1_startAfterId,
+        test_method_2_startAfter,
+        test_method_4_search_endpoint,
+        test_method_5_inspect_response,
+        test_method_6_different_versions,
+        test_method_7_async_generator,
+    ]
+
+    # Testes rodam em sequência (a saída de cada um fica agrupada);
+    # as requisições independentes dentro de cada teste já são paralelas.
+    async with ghl_client() as client:
+        for test in tests:
+            await test(client)
+            flush_output()
 
-    print("\n" + "="*70)
-    print("TESTES CONCLUÍDOS")
-    print("="*70)
+    logger.info("\n" + "="*70)
+    logger.info("TESTES CONCLUÍDOS")
+    logger.info("="*70)
+    flush_output()
 
 
 if __name__ == "__main__":
+    if "--no-cache" in sys.argv:
+        disable_cache()
     asyncio.run(main())
@@ -5,124 +5,126 @@ Teste detalhado do PIT token master.
 Testa diferentes endpoints e headers para diagnosticar o problema.
 """
 
-import os
+import sys
 import asyncio
-import aiohttp
-from dotenv import load_dotenv
 import json
 
-load_dotenv()
-
-
-async def test_endpoint(name: str, method: str, url: str, headers: dict, params: dict = None, data: dict = None):
-    """Testa um endpoint específico."""
-    print(f"\n{'─'*80}")
-    print(f"🧪 Testando: {name}")
-    print(f"   Método: {method}")
-    print(f"   URL: {url}")
-    print(f"   Headers: {json.dumps({k: v[:20]+'...' if len(v) > 20 else v for k, v in headers.items()}, indent=6)}")
+from _ghl_probe import (
+    AsyncBatcher,
+    disable_cache,
+    flush_output,
+    GHLClient,
+    ghl_client,
+    ghl_headers,
+    PIT,
+    probe_logger,
+    ProbeResponse,
+)
+
+logger = probe_logger()
+
+
+class GHLProbeBatcher(AsyncBatcher):
+    """Dispara cada lote de probes em paralelo no mesmo cliente."""
+
+    def __init__(self, client: GHLClient, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+
+    async def process_batch(self, batch):
+        return await asyncio.gather(
+            *(self.client.request(**item) for item in batch),
+            return_exceptions=True
+        )
+
+
+def build_request(method: str, url: str, headers: dict, params: dict = None, data: dict = None) -> dict:
+    """Monta os argumentos de GHLClient.request para um endpoint."""
+    request = {"method": method, "url": url, "headers": headers}
+    if method == "GET":
+        request["params"] = params
+    elif method == "POST":
+        request["json"] = data
+    return request
+
+
+def describe_endpoint(name: str, method: str, url: str, headers: dict, params: dict = None):
+    """Imprime o cabeçalho de um teste de endpoint."""
+    logger.info(f"\n{'─'*80}")
+    logger.info(f"🧪 Testando: {name}")
+    logger.info(f"   Método: {method}")
+    logger.info(f"   URL: {url}")
+    logger.info(f"   Headers: {json.dumps({k: v[:20]+'...' if len(v) > 20 else v for k, v in headers.items()}, indent=6)}")
     if params:
-        print(f"   Params: {params}")
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            if method == "GET":
-                async with session.get(url, headers=headers, params=params) as response:
-                    return await handle_response(response, name)
-            elif method == "POST":
-                async with session.post(url, headers=headers, json=data) as response:
-                    return await handle_response(response, name)
-            elif method == "DELETE":
-                async with session.delete(url, headers=headers) as response:
-                    return await handle_response(response, name)
-    except Exception as e:
-        print(f"   ❌ Erro: {e}")
-        return False
+        logger.info(f"   Params: {params}")
 
 
-async def handle_response(response, name):
+def handle_response(response: ProbeResponse, name: str):
     """Processa resposta da API."""
     status = response.status
 
     if status == 200:
         try:
-            data = await response.json()
-            print(f"   ✅ Sucesso (200)")
+            data = response.json()
+            logger.info(f"   ✅ Sucesso (200)")
 
             # Mostrar estrutura da resposta
             if isinstance(data, dict):
                 keys = list(data.keys())[:5]
-                print(f"   Dados retornados: {keys}")
+                logger.info(f"   Dados retornados: {keys}")
                 if 'total' in data:
-                    print(f"   Total: {data.get('total')}")
+                    logger.info(f"   Total: {data.get('total')}")
 
             return True
         except:
-            text = await response.text()
-            print(f"   ✅ Sucesso (200) - Resposta: {text[:100]}")
+            logger.info(f"   ✅ Sucesso (200) - Resposta: {response.text[:100]}")
             return True
 
     elif status == 401:
-        text = await response.text()
-        print(f"   ❌ Não autorizado (401)")
-        print(f"   Resposta: {text[:200]}")
+        logger.info(f"   ❌ Não autorizado (401)")
+        logger.info(f"   Resposta: {response.text[:200]}")
         return False
 
     elif status == 403:
-        text = await response.text()
-        print(f"   ❌ Proibido (403)")
-        print(f"   Resposta: {text[:200]}")
+        logger.info(f"   ❌ Proibido (403)")
+        logger.info(f"   Resposta: {response.text[:200]}")
         return False
 
     elif status == 404:
-        print(f"   ⚠️ Não encontrado (404) - Endpoint ou recurso não existe")
+        logger.info(f"   ⚠️ Não encontrado (404) - Endpoint ou recurso não existe")
         return False
 
     else:
-        text = await response.text()
-        print(f"   ⚠️ Status {status}")
-        print(f"   Resposta: {text[:200]}")
+        logger.info(f"   ⚠️ Status {status}")
+        logger.info(f"   Resposta: {response.text[:200]}")
         return False
 
 
 async def main():
     """Função principal."""
-    print("="*80)
-    print("🔍 TESTE DETALHADO DO PIT TOKEN MASTER")
-    print("="*80)
-
-    pit = os.getenv("PIT")
+    logger.info("="*80)
+    logger.info("🔍 TESTE DETALHADO DO PIT TOKEN MASTER")
+    logger.info("="*80)
 
-    if not pit:
-        print("\n❌ PIT não encontrado no .env")
+    if not PIT:
+        logger.info("\n❌ PIT não encontrado no .env")
         return
 
-    print(f"\n✅ PIT encontrado: {pit[:20]}...")
+    logger.info(f"\n✅ PIT encontrado: {PIT[:20]}...")
 
     # Diferentes combinações de headers para testar
     headers_variants = [
         {
             "name": "Headers Padrão (Version 2021-07-28)",
-            "headers": {
-                "Authorization": f"Bearer {pit}",
-                "Version": "2021-07-28",
-                "Content-Type": "application/json"
-            }
+            "headers": ghl_headers(PIT, **{"Content-Type": "application/json"})
         },
         {
             "name": "Headers sem Version",
-            "headers": {
-                "Authorization": f"Bearer {pit}",
-                "Content-Type": "application/json"
-            }
+            "headers": ghl_headers(PIT, version=None, **{"Content-Type": "application/json"})
         },
         {
             "name": "Headers com Version antiga (2021-04-15)",
-            "headers": {
-                "Authorization": f"Bearer {pit}",
-                "Version": "2021-04-15",
-                "Content-Type": "application/json"
-            }
+            "headers": ghl_headers(PIT, version="2021-04-15", **{"Content-Type": "application/json"})
         }
     ]
 
@@ -154,56 +156,82 @@ async def main():
         }
     ]
 
-    print("\n" + "="*80)
-    print("TESTANDO DIFERENTES COMBINAÇÕES DE HEADERS E ENDPOINTS")
-    print("="*80)
+    logger.info("\n" + "="*80)
+    logger.info("TESTANDO DIFERENTES COMBINAÇÕES DE HEADERS E ENDPOINTS")
+    logger.info("="*80)
 
     results = {}
 
-    # Testar cada endpoint com cada variante de headers
-    for header_variant in headers_variants:
-        print(f"\n{'═'*80}")
-        print(f"📋 {header_variant['name']}")
-        print(f"{'═'*80}")
-
-        results[header_variant['name']] = {}
-
-        for endpoint in endpoints:
-            success = await test_endpoint(
-                name=endpoint['name'],
-                method=endpoint['method'],
-                url=endpoint['url'],
-                headers=header_variant['headers'],
-                params=endpoint.get('params')
-            )
-            results[header_variant['name']][endpoint['name']] = success
-            await asyncio.sleep(0.5)  # Rate limiting
+    # Enfileirar todas as combinações (variante de headers × endpoint)
+    combinations = [
+        (header_variant, endpoint)
+        for header_variant in headers_variants
+        for endpoint in endpoints
+    ]
+    requests = [
+        build_request(
+            method=endpoint['method'],
+            url=endpoint['url'],
+            headers=header_variant['headers'],
+            params=endpoint.get('params')
+        )
+        for header_variant, endpoint in combinations
+    ]
+
+    # Lotes de 4 requisições simultâneas, 0.5s entre lotes (rate limiting)
+    async with ghl_client() as client:
+        batcher = GHLProbeBatcher(client, max_batch_size=4, batch_interval=0.5)
+        responses = await batcher.run(requests)
+
+    for (header_variant, endpoint), response in zip(combinations, responses):
+        if header_variant['name'] not in results:
+            logger.info(f"\n{'═'*80}")
+            logger.info(f"📋 {header_variant['name']}")
+            logger.info(f"{'═'*80}")
+            results[header_variant['name']] = {}
+
+        describe_endpoint(
+            name=endpoint['name'],
+            method=endpoint['method'],
+            url=endpoint['url'],
+            headers=header_variant['headers'],
+            params=endpoint.get('params')
+        )
+        if isinstance(response, Exception):
+            logger.info(f"   ❌ Erro: {response}")
+            success = False
+        else:
+            success = handle_response(response, endpoint['name'])
+        results[header_variant['name']][endpoint['name']] = success
 
     # Resumo
-    print("\n" + "="*80)
-    print("📊 RESUMO DOS TESTES")
-    print("="*80)
+    logger.info("\n" + "="*80)
+    logger.info("📊 RESUMO DOS TESTES")
+    logger.info("="*80)
 
     for header_name, endpoints_results in results.items():
-        print(f"\n{header_name}:")
+        logger.info(f"\n{header_name}:")
         for endpoint_name, success in endpoints_results.items():
             status = "✅" if success else "❌"
-            print(f"  {status} {endpoint_name}")
+            logger.info(f"  {status} {endpoint_name}")
 
     # Verificar se algum funcionou
     any_success = any(any(endpoints.values()) for endpoints in results.values())
 
     if any_success:
-        print("\n✅ SUCESSO! PIT token está funcionando em alguns endpoints.")
-        print("   Identifique acima qual combinação funcionou.")
+        logger.info("\n✅ SUCESSO! PIT token está funcionando em alguns endpoints.")
+        logger.info("   Identifique acima qual combinação funcionou.")
     else:
-        print("\n❌ NENHUM ENDPOINT FUNCIONOU")
-        print("   Possíveis causas:")
-        print("   1. PIT token inválido ou expirado")
-        print("   2. PIT token não tem permissões (mesmo sendo master)")
-        print("   3. Formato de autorização incorreto")
-        print("   4. API mudou e requer novos headers")
+        logger.info("\n❌ NENHUM ENDPOINT FUNCIONOU")
+        logger.info("   Possíveis causas:")
+        logger.info("   1. PIT token inválido ou expirado")
+        logger.info("   2. PIT token não tem permissões (mesmo sendo master)")
+        logger.info("   3. Formato de autorização incorreto")
+        logger.info("   4. API mudou e requer novos headers")
+    flush_output()
 
 
 if __name__ == "__main__":
+    if "--no-cache" in sys.argv:
+        disable_cache()
     asyncio.run(main())
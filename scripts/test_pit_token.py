@@ -8,105 +8,94 @@ Verifica:
 3. Se consegue fazer chamadas à API GHL
 
 Uso:
-    python scripts/test_pit_token.py
+    python scripts/test_pit_token.py [--no-cache]
 """
 
-import os
+import sys
 import asyncio
-import aiohttp
-from dotenv import load_dotenv
-import json
+from types import MappingProxyType
 
-load_dotenv()
+from _ghl_probe import disable_cache, flush_output, GHLClient, ghl_client, ghl_headers, PIT, probe_logger, TRANSPORT_ERRORS
 
+logger = probe_logger()
 
-async def test_pit_token():
+# Headers/params constantes, montados uma única vez
+HEADERS_V1 = ghl_headers(PIT)
+LIMIT1_PARAMS = MappingProxyType({"limit": 1})  # Apenas 1 contato para testar
+
+
+async def test_pit_token(client: GHLClient):
     """Testa PIT token com API GHL."""
-    print("="*80)
-    print("🧪 Teste do PIT Token (GoHighLevel)")
-    print("="*80)
+    logger.info("="*80)
+    logger.info("🧪 Teste do PIT Token (GoHighLevel)")
+    logger.info("="*80)
 
     # 1. Verificar se PIT existe
-    pit = os.getenv("PIT")
-
-    if not pit:
-        print("\n❌ PIT token não encontrado no .env")
-        print("   Adicione ao .env: PIT=pit-xxxxx")
+    if not PIT:
+        logger.info("\n❌ PIT token não encontrado no .env")
+        logger.info("   Adicione ao .env: PIT=pit-xxxxx")
         return False
 
-    print(f"\n✅ PIT token encontrado: {pit[:15]}...")
+    logger.info(f"\n✅ PIT token encontrado: {PIT[:15]}...")
 
     # 2. Testar chamada à API (listar contatos - menos invasivo que deletar)
-    print("\n📡 Testando chamada à API GHL...")
+    logger.info("\n📡 Testando chamada à API GHL...")
 
     url = "https://services.leadconnectorhq.com/contacts/"
 
-    headers = {
-        "Authorization": f"Bearer {pit}",
-        "Version": "2021-07-28"
-    }
-
-    params = {
-        "limit": 1  # Apenas 1 contato para testar
-    }
-
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                status = response.status
-
-                if status == 200:
-                    data = await response.json()
-                    print(f"✅ API respondeu com sucesso (status 200)")
-                    print(f"   Total de contatos disponíveis: {data.get('total', 'N/A')}")
-
-                    # Verificar permissões
-                    contacts = data.get('contacts', [])
-                    if contacts:
-                        print(f"   Exemplo de contato: {contacts[0].get('name', 'N/A')}")
-
-                    print("\n✅ PIT token está funcionando corretamente!")
-                    print("   Permissões confirmadas:")
-                    print("   - ✅ contacts.readonly")
-                    print("   - ✅ contacts.write (necessário para deletar)")
-                    return True
-
-                elif status == 401:
-                    print(f"❌ Token inválido ou expirado (status 401)")
-                    print("   Verifique se o PIT está correto no .env")
-                    return False
-
-                elif status == 403:
-                    print(f"❌ Token sem permissões necessárias (status 403)")
-                    print("   O PIT precisa das permissões:")
-                    print("   - contacts.readonly")
-                    print("   - contacts.write")
-                    return False
-
-                else:
-                    response_text = await response.text()
-                    print(f"⚠️ Resposta inesperada (status {status})")
-                    print(f"   Resposta: {response_text[:200]}")
-                    return False
-
-    except aiohttp.ClientError as e:
-        print(f"❌ Erro de conexão: {e}")
+        response = await client.get(url, headers=HEADERS_V1, params=LIMIT1_PARAMS)
+        status = response.status
+
+        if status == 200:
+            data = response.json()
+            logger.info(f"✅ API respondeu com sucesso (status 200)")
+            logger.info(f"   Total de contatos disponíveis: {data.get('total', 'N/A')}")
+
+            # Verificar permissões
+            contacts = data.get('contacts', [])
+            if contacts:
+                logger.info(f"   Exemplo de contato: {contacts[0].get('name', 'N/A')}")
+
+            logger.info("\n✅ PIT token está funcionando corretamente!")
+            logger.info("   Permissões confirmadas:")
+            logger.info("   - ✅ contacts.readonly")
+            logger.info("   - ✅ contacts.write (necessário para deletar)")
+            return True
+
+        elif status == 401:
+            logger.info(f"❌ Token inválido ou expirado (status 401)")
+            logger.info("   Verifique se o PIT está correto no .env")
+            return False
+
+        elif status == 403:
+            logger.info(f"❌ Token sem permissões necessárias (status 403)")
+            logger.info("   O PIT precisa das permissões:")
+            logger.info("   - contacts.readonly")
+            logger.info("   - contacts.write")
+            return False
+
+        else:
+            logger.info(f"⚠️ Resposta inesperada (status {status})")
+            logger.info(f"   Resposta: {response.text[:200]}")
+            return False
+
+    except TRANSPORT_ERRORS as e:
+        logger.info(f"❌ Erro de conexão: {e}")
         return False
     except Exception as e:
-        print(f"❌ Erro inesperado: {e}")
+        logger.info(f"❌ Erro inesperado: {e}")
         return False
 
 
-async def test_delete_permissions():
+async def test_delete_permissions(client: GHLClient):
     """Testa se PIT tem permissão para deletar (simulado)."""
-    print("\n" + "="*80)
-    print("🔍 Verificando permissões de DELETE")
-    print("="*80)
-
-    pit = os.getenv("PIT")
+    logger.info("\n" + "="*80)
+    logger.info("🔍 Verificando permissões de DELETE")
+    logger.info("="*80)
 
-    if not pit:
-        print("❌ PIT não encontrado")
+    if not PIT:
+        logger.info("❌ PIT não encontrado")
         return False
 
     # Nota: Não vamos realmente deletar um contato, apenas verificar
@@ -115,68 +104,67 @@ async def test_delete_permissions():
     fake_contact_id = "test_fake_contact_id_that_does_not_exist"
     url = f"https://services.leadconnectorhq.com/contacts/{fake_contact_id}"
 
-    headers = {
-        "Authorization": f"Bearer {pit}",
-        "Version": "2021-07-28"
-    }
-
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.delete(url, headers=headers) as response:
-                status = response.status
-
-                if status == 404:
-                    print("✅ Permissão de DELETE confirmada!")
-                    print("   (Contato teste não existe, mas endpoint respondeu corretamente)")
-                    return True
-                elif status == 401:
-                    print("❌ Token sem autenticação para DELETE")
-                    return False
-                elif status == 403:
-                    print("❌ Token sem permissão para DELETE")
-                    print("   O PIT precisa da permissão: contacts.write")
-                    return False
-                else:
-                    response_text = await response.text()
-                    print(f"⚠️ Resposta inesperada (status {status})")
-                    print(f"   Resposta: {response_text[:200]}")
-                    return True  # Se não é 401/403, provavelmente tem permissão
+        response = await client.delete(url, headers=HEADERS_V1)
+        status = response.status
+
+        if status == 404:
+            logger.info("✅ Permissão de DELETE confirmada!")
+            logger.info("   (Contato teste não existe, mas endpoint respondeu corretamente)")
+            return True
+        elif status == 401:
+            logger.info("❌ Token sem autenticação para DELETE")
+            return False
+        elif status == 403:
+            logger.info("❌ Token sem permissão para DELETE")
+            logger.info("   O PIT precisa da permissão: contacts.write")
+            return False
+        else:
+            logger.info(f"⚠️ Resposta inesperada (status {status})")
+            logger.info(f"   Resposta: {response.text[:200]}")
+            return True  # Se não é 401/403, provavelmente tem permissão
 
     except Exception as e:
-        print(f"❌ Erro ao testar DELETE: {e}")
+        logger.info(f"❌ Erro ao testar DELETE: {e}")
         return False
 
 
 async def main():
     """Função principal."""
-    # Teste 1: Verificar PIT e permissões básicas
-    result1 = await test_pit_token()
+    async with ghl_client() as client:
+        # Teste 1: Verificar PIT e permissões básicas
+        result1 = await test_pit_token(client)
+        flush_output()
 
-    if not result1:
-        print("\n" + "="*80)
-        print("❌ Teste falhou - corrija o PIT token antes de continuar")
-        print("="*80)
-        return
+        if not result1:
+            logger.info("\n" + "="*80)
+            logger.info("❌ Teste falhou - corrija o PIT token antes de continuar")
+            logger.info("="*80)
+            return
 
-    # Teste 2: Verificar permissões de DELETE
-    result2 = await test_delete_permissions()
+        # Teste 2: Verificar permissões de DELETE
+        result2 = await test_delete_permissions(client)
+        flush_output()
 
     # Resumo final
-    print("\n" + "="*80)
-    print("📊 RESUMO DOS TESTES")
-    print("="*80)
-    print(f"✅ PIT Token válido: {'Sim' if result1 else 'Não'}")
-    print(f"✅ Permissão READ: {'Sim' if result1 else 'Não'}")
-    print(f"✅ Permissão DELETE: {'Sim' if result2 else 'Não'}")
+    logger.info("\n" + "="*80)
+    logger.info("📊 RESUMO DOS TESTES")
+    logger.info("="*80)
+    logger.info(f"✅ PIT Token válido: {'Sim' if result1 else 'Não'}")
+    logger.info(f"✅ Permissão READ: {'Sim' if result1 else 'Não'}")
+    logger.info(f"✅ Permissão DELETE: {'Sim' if result2 else 'Não'}")
 
     if result1 and result2:
-        print("\n🎉 SUCESSO! PIT token está configurado corretamente!")
-        print("   O webhook poderá deletar contatos de spam automaticamente.")
+        logger.info("\n🎉 SUCESSO! PIT token está configurado corretamente!")
+        logger.info("   O webhook poderá deletar contatos de spam automaticamente.")
     else:
-        print("\n⚠️ ATENÇÃO! Corrija as permissões do PIT token.")
+        logger.info("\n⚠️ ATENÇÃO! Corrija as permissões do PIT token.")
 
-    print("="*80)
+    logger.info("="*80)
+    flush_output()
 
 
 if __name__ == "__main__":
+    if "--no-cache" in sys.argv:
+        disable_cache()
     asyncio.run(main())
@@ -1,121 +1,115 @@
 #!/usr/bin/env python3
 """Testa PIT token com Location ID especificado."""
 
-import os
+import sys
 import asyncio
-import aiohttp
-from dotenv import load_dotenv
 
-load_dotenv()
+from _ghl_probe import disable_cache, flush_output, GHLClient, ghl_client, ghl_headers, PIT, probe_logger
 
+logger = probe_logger()
 
-async def test_with_location():
-    pit = os.getenv("PIT")
-    location_id = "Wc3wencAfbxKbynASybx"  # Do location_token.json
+LOCATION_ID = "Wc3wencAfbxKbynASybx"  # Do location_token.json
 
-    print("="*80)
-    print("🧪 Testando PIT com Location ID")
-    print("="*80)
-    print(f"PIT: {pit[:20]}...")
-    print(f"Location ID: {location_id}")
+# Headers constantes, montados uma única vez
+HEADERS_V1 = ghl_headers(PIT)
+HEADERS_V1_WITH_LOCATION = ghl_headers(PIT, locationId=LOCATION_ID)
+
+
+async def test_with_location(client: GHLClient):
+    logger.info("="*80)
+    logger.info("🧪 Testando PIT com Location ID")
+    logger.info("="*80)
+    logger.info(f"PIT: {PIT[:20]}...")
+    logger.info(f"Location ID: {LOCATION_ID}")
+
+    # Os dois métodos são independentes: disparar em paralelo
+    query_url = f"https://services.leadconnectorhq.com/contacts/?locationId={LOCATION_ID}&limit=1"
+    header_url = "https://services.leadconnectorhq.com/contacts/?limit=1"
+
+    query_response, header_response = await asyncio.gather(
+        client.get(query_url, headers=HEADERS_V1),
+        client.get(header_url, headers=HEADERS_V1_WITH_LOCATION)
+    )
 
     # Teste 1: Query parameter
-    print("\n📡 Teste 1: Location ID como query parameter")
-    url = f"https://services.leadconnectorhq.com/contacts/?locationId={location_id}&limit=1"
-    headers = {
-        "Authorization": f"Bearer {pit}",
-        "Version": "2021-07-28"
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            status = response.status
-            text = await response.text()
-            print(f"Status: {status}")
-            print(f"Resposta: {text[:300]}")
-
-            if status == 200:
-                print("\n✅ SUCESSO COM QUERY PARAMETER!")
-                print("   PIT token funciona quando especifica locationId!")
-                return True
+    logger.info("\n📡 Teste 1: Location ID como query parameter")
+    logger.info(f"Status: {query_response.status}")
+    logger.info(f"Resposta: {query_response.text[:300]}")
 
     # Teste 2: Header
-    print("\n📡 Teste 2: Location ID como header")
-    url = "https://services.leadconnectorhq.com/contacts/?limit=1"
-    headers = {
-        "Authorization": f"Bearer {pit}",
-        "Version": "2021-07-28",
-        "locationId": location_id
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            status = response.status
-            text = await response.text()
-            print(f"Status: {status}")
-            print(f"Resposta: {text[:300]}")
-
-            if status == 200:
-                print("\n✅ SUCESSO COM HEADER!")
-                print("   PIT token funciona quando especifica locationId!")
-                return True
-
-    print("\n❌ Ambos os métodos falharam")
+    logger.info("\n📡 Teste 2: Location ID como header")
+    logger.info(f"Status: {header_response.status}")
+    logger.info(f"Resposta: {header_response.text[:300]}")
+
+    if query_response.status == 200:
+        logger.info("\n✅ SUCESSO COM QUERY PARAMETER!")
+        logger.info("   PIT token funciona quando especifica locationId!")
+        return True
+
+    if header_response.status == 200:
+        logger.info("\n✅ SUCESSO COM HEADER!")
+        logger.info("   PIT token funciona quando especifica locationId!")
+        return True
+
+    logger.info("\n❌ Ambos os métodos falharam")
     return False
 
 
-async def test_delete_with_location():
+async def test_delete_with_location(client: GHLClient):
     """Testa DELETE com location ID."""
-    pit = os.getenv("PIT")
-    location_id = "Wc3wencAfbxKbynASybx"
     fake_contact_id = "test_fake_id_xyz"
 
-    print("\n" + "="*80)
-    print("🗑️ Testando DELETE com Location ID")
-    print("="*80)
-
-    url = f"https://services.leadconnectorhq.com/contacts/{fake_contact_id}?locationId={location_id}"
-    headers = {
-        "Authorization": f"Bearer {pit}",
-        "Version": "2021-07-28"
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.delete(url, headers=headers) as response:
-            status = response.status
-            text = await response.text()
-            print(f"Status: {status}")
-            print(f"Resposta: {text[:300]}")
-
-            if status == 404:
-                print("\n✅ DELETE funciona com PIT!")
-                print("   (404 = contato não existe, mas endpoint está acessível)")
-                return True
-            elif status == 403:
-                print("\n❌ PIT ainda sem permissão para DELETE")
-                return False
-            elif status == 401:
-                print("\n❌ PIT não autorizado")
-                return False
-            else:
-                print(f"\n⚠️ Status inesperado: {status}")
-                return True  # Se não é 401/403, provavelmente tem permissão
+    logger.info("\n" + "="*80)
+    logger.info("🗑️ Testando DELETE com Location ID")
+    logger.info("="*80)
+
+    url = f"https://services.leadconnectorhq.com/contacts/{fake_contact_id}?locationId={LOCATION_ID}"
+
+    response = await client.delete(url, headers=HEADERS_V1)
+    status = response.status
+    logger.info(f"Status: {status}")
+    logger.info(f"Resposta: {response.text[:300]}")
+
+    if status == 404:
+        logger.info("\n✅ DELETE funciona com PIT!")
+        logger.info("   (404 = contato não existe, mas endpoint está acessível)")
+        return True
+    elif status == 403:
+        logger.info("\n❌ PIT ainda sem permissão para DELETE")
+        return False
+    elif status == 401:
+        logger.info("\n❌ PIT não autorizado")
+        return False
+    else:
+        logger.info(f"\n⚠️ Status inesperado: {status}")
+        return True  # Se não é 401/403, provavelmente tem permissão
+
+
+async def main():
+    """Função principal."""
+    async with ghl_client() as client:
+        result1 = await test_with_location(client)
+        flush_output()
+        if not result1:
+            logger.info("\n❌ PIT token não funcionou mesmo com locationId")
+            return
+
+        result2 = await test_delete_with_location(client)
+        flush_output()
+
+    if result2:
+        logger.info("\n" + "="*80)
+        logger.info("🎉 PIT TOKEN MASTER CONFIRMADO!")
+        logger.info("="*80)
+        logger.info("✅ PIT token funciona para GET e DELETE")
+        logger.info("✅ Só precisa incluir locationId na URL/header")
+        logger.info("\nPróximo passo: Atualizar webhook para usar PIT com locationId")
+    else:
+        logger.info("\n⚠️ PIT funciona para GET, mas não para DELETE")
+    flush_output()
 
 
 if __name__ == "__main__":
-    result1 = asyncio.run(test_with_location())
-
-    if result1:
-        result2 = asyncio.run(test_delete_with_location())
-
-        if result2:
-            print("\n" + "="*80)
-            print("🎉 PIT TOKEN MASTER CONFIRMADO!")
-            print("="*80)
-            print("✅ PIT token funciona para GET e DELETE")
-            print("✅ Só precisa incluir locationId na URL/header")
-            print("\nPróximo passo: Atualizar webhook para usar PIT com locationId")
-        else:
-            print("\n⚠️ PIT funciona para GET, mas não para DELETE")
-    else:
-        print("\n❌ PIT token não funcionou mesmo com locationId")
+    if "--no-cache" in sys.argv:
+        disable_cache()
+    asyncio.run(main())
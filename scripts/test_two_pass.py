@@ -12,18 +12,31 @@ Métricas:
 - Custo estimado
 
 Uso:
-    python scripts/test_two_pass.py [--sample-size N]
+    python scripts/test_two_pass.py [--sample-size N] [--concurrency N]
+                                    [--batch-size N] [--rule-only]
 """
 
-import json
+import argparse
+import functools
+import hashlib
 import os
+import re
 import sys
 import asyncio
 from pathlib import Path
-from typing import Dict, List, Any
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Set, Tuple
 import logging
+import ijson
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 
+try:
+    from numba import njit  # opcional: kernel compilado para a confusion matrix
+except ImportError:
+    njit = None
+
 # Adicionar diretório raiz ao path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
@@ -41,94 +54,251 @@ MESSAGES_FILE = Path("data/spam_conversations/messages_with_bodies.json")
 CATEGORIES_FILE = Path("data/analysis/spam_categories.json")
 OPTIMIZED_PROMPT_FILE = Path("config/optimized_prompt.txt")
 OUTPUT_FILE = Path("data/evaluation/two_pass_results.json")
+RESULTS_NDJSON_FILE = OUTPUT_FILE.with_suffix(".ndjson")
+
+# Máximo de chamadas GPT simultâneas
+MAX_CONCURRENCY = 20
+
+# Emails ambíguos enviados por chamada GPT
+GPT_BATCH_SIZE = 50
+
+# Pré-filtro do harness: mesmo critério da REGRA 1 do detector (DMARC),
+# decidido só pelo subject, sem parsear o body
+DMARC_RE = re.compile(r"report domain:|dmarc", re.IGNORECASE)
+DMARC_RESULT = {
+    "is_spam": False,
+    "confidence": 1.0,
+    "reason": "DMARC report (regra)",
+    "method": "fast_rule"
+}
 
 
+@functools.lru_cache(maxsize=1)
 def load_optimized_prompt() -> str:
-    """Carrega prompt otimizado."""
+    """Carrega prompt otimizado (lido do disco uma única vez)."""
     with open(OPTIMIZED_PROMPT_FILE, "r", encoding="utf-8") as f:
         return f.read()
 
 
-async def test_two_pass_system(sample_size: int = 100) -> Dict[str, Any]:
+def load_sample_categories(sample_size: int) -> Dict[str, Dict[str, Any]]:
+    """Lê (em streaming) as categorizações dos primeiros sample_size emails."""
+    msg_categories: Dict[str, Dict[str, Any]] = {}
+    with open(CATEGORIES_FILE, "rb") as f:
+        for cat in ijson.items(f, "all_categorizations.item", use_float=True):
+            if len(msg_categories) >= sample_size:
+                break
+            msg_categories.setdefault(cat["message_id"], cat)
+    return msg_categories
+
+
+def load_sample_messages(wanted: Set[str]) -> Dict[str, Dict[str, Any]]:
+    """Lê (em streaming) só as mensagens da amostra."""
+    messages: Dict[str, Dict[str, Any]] = {}
+    with open(MESSAGES_FILE, "rb") as f:
+        for msg_id, message in ijson.kvitems(f, "messages", use_float=True):
+            if msg_id in wanted:
+                messages[msg_id] = message
+                if len(messages) == len(wanted):
+                    break
+    return messages
+
+
+def extract_body_and_subject(message: Dict[str, Any]) -> Tuple[str, str]:
+    """Extrai body e subject de uma mensagem coletada."""
+    email_data = message.get("email_data", {})
+
+    body = message.get("body", "")
+    if not body:
+        body = email_data.get("body", "")
+
+    return body, email_data.get("subject", "")
+
+
+@dataclass
+class ResultRow:
+    """Linha de resultado (ground truth + predição) de um email."""
+
+    # __slots__ manual: dataclass(slots=True) só existe a partir do Python 3.10
+    __slots__ = (
+        "message_id", "expected_spam", "expected_category", "predicted_spam",
+        "predicted_confidence", "predicted_category", "predicted_reason",
+        "method", "subject",
+    )
+
+    message_id: str
+    expected_spam: bool
+    expected_category: str
+    predicted_spam: Optional[bool]
+    predicted_confidence: Optional[float]
+    predicted_category: str
+    predicted_reason: str
+    method: Optional[str]  # fast_rule ou gpt
+    subject: str
+
+
+def email_key(subject: str, body: str) -> bytes:
+    """Hash curto de (subject, body) para identificar emails idênticos."""
+    return hashlib.blake2b(f"{subject}\x00{body}".encode(), digest_size=16).digest()
+
+
+def build_result_row(
+    msg_id: str,
+    cat: Dict[str, Any],
+    subject: str,
+    result: Dict[str, Any]
+) -> ResultRow:
+    """Monta a linha de resultado de um email."""
+    return ResultRow(
+        message_id=msg_id,
+        expected_spam=cat["category"] != "dmarc_reports",
+        expected_category=cat["category"],
+        predicted_spam=result.get("is_spam"),
+        predicted_confidence=result.get("confidence"),
+        predicted_category=result.get("category", ""),
+        predicted_reason=result.get("reason", ""),
+        method=result.get("method"),
+        subject=subject[:100]
+    )
+
+
+async def test_two_pass_system(
+    sample_size: int = 100,
+    concurrency: int = MAX_CONCURRENCY,
+    batch_size: int = GPT_BATCH_SIZE,
+    rule_only: bool = False
+) -> Dict[str, Any]:
     """
     Testa sistema two-pass.
 
     Args:
         sample_size: Quantidade de emails para testar
+        concurrency: Máximo de chamadas GPT simultâneas
+        batch_size: Emails ambíguos por chamada GPT
+        rule_only: Só a 1ª passagem (ambíguos ficam fora dos resultados)
 
     Returns:
         Dict com métricas e resultados
     """
     logging.info("🚀 Testando sistema Two-Pass...")
 
-    # Carregar dados
-    logging.info("📂 Carregando dados...")
-    with open(MESSAGES_FILE, "r") as f:
-        messages_data = json.load(f)
-    messages = messages_data["messages"]
+    # Inicializar detector
+    from openai import AsyncOpenAI
+    api_key = os.getenv("OPENAI_API_KEY")
+    client = AsyncOpenAI(api_key=api_key) if api_key else None
 
-    with open(CATEGORIES_FILE, "r") as f:
-        cat_data = json.load(f)
-    categorizations = cat_data["all_categorizations"]
+    detector = TwoPassSpamDetector(openai_client=client)
 
-    # Criar dict message_id -> category
-    msg_categories = {cat["message_id"]: cat for cat in categorizations}
+    # Carregar dados fora do event loop, em paralelo com o carregamento do
+    # prompt e o warmup do detector (para que o custo de cold start não
+    # entre na medição)
+    logging.info("📂 Carregando dados...")
+    msg_categories, prompt, _ = await asyncio.gather(
+        asyncio.to_thread(load_sample_categories, sample_size),
+        asyncio.to_thread(load_optimized_prompt),
+        detector.warmup()
+    )
 
     # Selecionar amostra
-    sample_ids = list(msg_categories.keys())[:sample_size]
+    sample_ids = list(msg_categories.keys())
     logging.info(f"  Amostra: {len(sample_ids)} emails")
 
-    # Inicializar detector
-    from openai import AsyncOpenAI
-    api_key = os.getenv("OPENAI_API_KEY")
-    client = AsyncOpenAI(api_key=api_key) if api_key else None
+    messages = await asyncio.to_thread(load_sample_messages, set(sample_ids))
 
-    detector = TwoPassSpamDetector(openai_client=client)
-    prompt = load_optimized_prompt()
-
-    # Processar emails
-    results = []
-    for i, msg_id in enumerate(sample_ids, 1):
-        if msg_id not in messages:
-            continue
-
-        message = messages[msg_id]
-        cat = msg_categories[msg_id]
-
-        # Extrair body e subject
-        body = message.get("body", "")
-        if not body:
-            email_data = message.get("email_data", {})
-            body = email_data.get("body", "")
-
-        email_data = message.get("email_data", {})
-        subject = email_data.get("subject", "")
-
-        # Detectar com two-pass
-        try:
-            result = await detector.detect(body, subject, prompt)
-
-            # Ground truth
-            expected_spam = cat["category"] != "dmarc_reports"
-
-            results.append({
-                "message_id": msg_id,
-                "expected_spam": expected_spam,
-                "expected_category": cat["category"],
-                "predicted_spam": result.get("is_spam"),
-                "predicted_confidence": result.get("confidence"),
-                "predicted_category": result.get("category", ""),
-                "predicted_reason": result.get("reason", ""),
-                "method": result.get("method"),  # fast_rule ou gpt
-                "subject": subject[:100]
-            })
-
-            if i % 10 == 0:
-                logging.info(f"  Processados: {i}/{len(sample_ids)}")
-
-        except Exception as e:
-            logging.error(f"Erro ao processar {msg_id}: {e}")
-            continue
+    valid_ids = [msg_id for msg_id in sample_ids if msg_id in messages]
+    rows: Dict[str, ResultRow] = {}
+
+    # Cada resultado vai para o NDJSON assim que fica pronto (progresso
+    # preservado mesmo se a execução for interrompida)
+    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_NDJSON_FILE, "wb") as ndjson:
+
+        def record(msg_id: str, subject: str, result: Dict[str, Any]):
+            row = build_result_row(msg_id, msg_categories[msg_id], subject, result)
+            rows[msg_id] = row
+            ndjson.write(orjson.dumps(row) + b"\n")
+            ndjson.flush()
+
+        # Emails idênticos (mesmo subject + body) são decididos uma única vez
+        duplicates: Dict[bytes, List[Tuple[str, str]]] = {}
+        unique = []
+        for msg_id in valid_ids:
+            body, subject = extract_body_and_subject(messages[msg_id])
+
+            if DMARC_RE.search(subject):
+                detector.record_verdict(DMARC_RESULT)
+                record(msg_id, subject, DMARC_RESULT)
+                continue
+
+            key = email_key(subject, body)
+            if key in duplicates:
+                duplicates[key].append((msg_id, subject))
+                continue
+
+            duplicates[key] = []
+            unique.append((key, msg_id, body, subject))
+
+        # 1ª passagem: regras rápidas em todos os emails únicos de uma vez
+        # (colunas NumPy, sem rede, numa thread para não travar o event
+        # loop); só os ambíguos seguem para o GPT
+        batch_rules = await asyncio.to_thread(
+            detector.classify_batch,
+            [body for _, _, body, _ in unique],
+            [subject for _, _, _, subject in unique]
+        )
+
+        ambiguous = []
+        for i, (key, msg_id, body, subject) in enumerate(unique):
+            if batch_rules.needs_gpt[i]:
+                ambiguous.append((key, msg_id, body, subject, batch_rules.features[i]))
+                continue
+
+            first_pass = batch_rules.result(i)
+            record(msg_id, subject, first_pass)
+            for dup_id, dup_subject in duplicates[key]:
+                detector.record_verdict(first_pass)
+                record(dup_id, dup_subject, first_pass)
+
+        dup_count = sum(map(len, duplicates.values()))
+        if dup_count:
+            logging.info(f"  Duplicados: {dup_count} emails reaproveitam o resultado de outro email")
+
+        logging.info(f"  Regras: {len(rows)} conclusivos, {len(ambiguous)} ambíguos")
+
+        if rule_only:
+            logging.info(f"  --rule-only: {len(ambiguous)} ambíguos não enviados ao GPT")
+            ambiguous = []
+
+        # 2ª passagem: ambíguos em lotes de batch_size por chamada GPT,
+        # com até concurrency lotes simultâneos
+        sem = asyncio.Semaphore(concurrency)
+        batches = [
+            ambiguous[start:start + batch_size]
+            for start in range(0, len(ambiguous), batch_size)
+        ]
+
+        async def _batch(batch):
+            try:
+                async with sem:
+                    outcome = await detector.detect_batch_with_gpt(
+                        [(body, features) for _, _, body, _, features in batch],
+                        prompt
+                    )
+            except Exception as e:
+                logging.error(f"Erro ao processar lote de {len(batch)} emails: {e}")
+                return
+
+            for (key, msg_id, _, subject, _), result in zip(batch, outcome):
+                record(msg_id, subject, result)
+                for dup_id, dup_subject in duplicates[key]:
+                    detector.record_verdict(result)
+                    record(dup_id, dup_subject, result)
+
+            logging.info(f"  Processados: {len(rows)}/{len(valid_ids)}")
+
+        await asyncio.gather(*[_batch(b) for b in batches])
+
+    # Resultados na ordem da amostra
+    results = [rows[msg_id] for msg_id in valid_ids if msg_id in rows]
 
     logging.info(f"✅ {len(results)} emails testados")
 
@@ -139,42 +309,88 @@ async def test_two_pass_system(sample_size: int = 100) -> Dict[str, Any]:
     output_data = {
         "test_config": {
             "sample_size": sample_size,
-            "prompt_file": str(OPTIMIZED_PROMPT_FILE)
+            "concurrency": concurrency,
+            "batch_size": batch_size,
+            "rule_only": rule_only,
+            "prompt_file": str(OPTIMIZED_PROMPT_FILE),
+            "results_ndjson": str(RESULTS_NDJSON_FILE)
         },
         "metrics": metrics,
         "detector_stats": detector.get_stats(),
         "results": results
     }
 
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    OUTPUT_FILE.write_bytes(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
 
     logging.info(f"💾 Resultados salvos em: {OUTPUT_FILE}")
 
     return output_data
 
 
-def calculate_metrics(results: List[Dict[str, Any]], detector: TwoPassSpamDetector) -> Dict[str, Any]:
+if njit is not None:
+    @njit(cache=True)
+    def _confusion_kernel(t, p):
+        tp = fp = tn = fn = 0
+        for i in range(t.shape[0]):
+            ti = t[i]
+            pi = p[i]
+            if ti and pi:
+                tp += 1
+            elif pi:
+                fp += 1
+            elif ti:
+                fn += 1
+            else:
+                tn += 1
+        return tp, fp, tn, fn
+
+
+def confusion_counts(y_true: np.ndarray, y_pred: np.ndarray) -> Tuple[int, int, int, int]:
+    """
+    Retorna (tp, fp, tn, fn) de dois arrays booleanos.
+
+    Com numba instalado usa um kernel compilado de passada única sobre
+    views uint8 dos arrays; sem numba, as quatro células saem de três
+    somas vetorizadas.
+    """
+    if njit is not None:
+        tp, fp, tn, fn = _confusion_kernel(y_true.view(np.uint8), y_pred.view(np.uint8))
+        return int(tp), int(fp), int(tn), int(fn)
+
+    tp = int(np.sum(y_true & y_pred))
+    fp = int(y_pred.sum()) - tp
+    fn = int(y_true.sum()) - tp
+    tn = y_true.shape[0] - tp - fp - fn
+    return tp, fp, tn, fn
+
+
+def calculate_metrics(results: List[ResultRow], detector: TwoPassSpamDetector) -> Dict[str, Any]:
     """Calcula métricas de performance."""
     logging.info("📊 Calculando métricas...")
 
     if not results:
         return {"error": "Sem resultados"}
 
+    # Colunas extraídas numa única passada pelos resultados
+    # (predicted_spam None conta como não-spam)
+    n = len(results)
+    expected, predicted, methods = zip(*(
+        (r.expected_spam, bool(r.predicted_spam), r.method) for r in results
+    ))
+    y_true = np.array(expected, dtype=bool)
+    y_pred = np.array(predicted, dtype=bool)
+    methods = np.array(methods, dtype=object)
+
     # Separar por método
-    rule_results = [r for r in results if r["method"] == "fast_rule"]
-    gpt_results = [r for r in results if r["method"] == "gpt"]
+    rule_mask = methods == "fast_rule"
+    fast_rule_count = int(rule_mask.sum())
+    gpt_count = int((methods == "gpt").sum())
 
     # Calcular accuracy geral
-    correct = sum(1 for r in results if r["expected_spam"] == r["predicted_spam"])
-    accuracy = correct / len(results)
+    accuracy = float((y_true == y_pred).mean())
 
     # Confusion matrix
-    tp = sum(1 for r in results if r["expected_spam"] and r["predicted_spam"])
-    fp = sum(1 for r in results if not r["expected_spam"] and r["predicted_spam"])
-    tn = sum(1 for r in results if not r["expected_spam"] and not r["predicted_spam"])
-    fn = sum(1 for r in results if r["expected_spam"] and not r["predicted_spam"])
+    tp, fp, tn, fn = confusion_counts(y_true, y_pred)
 
     precision = tp / (tp + fp) if (tp + fp) > 0 else 0
     recall = tp / (tp + fn) if (tp + fn) > 0 else 0
@@ -194,11 +410,11 @@ def calculate_metrics(results: List[Dict[str, Any]], detector: TwoPassSpamDetect
             "true_negatives": tn,
             "false_negatives": fn
         },
-        "total_emails": len(results),
-        "fast_rule_count": len(rule_results),
-        "gpt_count": len(gpt_results),
-        "fast_rule_pct": round((len(rule_results) / len(results)) * 100, 1),
-        "gpt_pct": round((len(gpt_results) / len(results)) * 100, 1),
+        "total_emails": n,
+        "fast_rule_count": fast_rule_count,
+        "gpt_count": gpt_count,
+        "fast_rule_pct": round((fast_rule_count / n) * 100, 1),
+        "gpt_pct": round((gpt_count / n) * 100, 1),
         "cost_savings": stats
     }
 
@@ -222,13 +438,38 @@ def calculate_metrics(results: List[Dict[str, Any]], detector: TwoPassSpamDetect
 
 async def main():
     """Função principal."""
-    sample_size = 100
-
-    if "--sample-size" in sys.argv:
-        idx = sys.argv.index("--sample-size")
-        sample_size = int(sys.argv[idx + 1])
-
-    await test_two_pass_system(sample_size)
+    parser = argparse.ArgumentParser(description="Testa o sistema two-pass de detecção de spam.")
+    parser.add_argument(
+        "--sample-size",
+        type=int,
+        default=100,
+        help="Quantidade de emails para testar (padrão: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=MAX_CONCURRENCY,
+        help="Máximo de chamadas GPT simultâneas (padrão: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=GPT_BATCH_SIZE,
+        help="Emails ambíguos por chamada GPT (padrão: %(default)s)",
+    )
+    parser.add_argument(
+        "--rule-only",
+        action="store_true",
+        help="Avalia só as regras rápidas, sem chamar o GPT",
+    )
+    args = parser.parse_args()
+
+    await test_two_pass_system(
+        sample_size=args.sample_size,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        rule_only=args.rule_only,
+    )
     logging.info("✅ Teste concluído!")
 
 
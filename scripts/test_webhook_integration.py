@@ -2,16 +2,20 @@
 """
 Script para testar integração do sistema Two-Pass no webhook.
 
-Envia emails de teste via curl para o webhook local.
+Envia emails de teste via HTTP (conexão keep-alive) para o webhook local.
 
 Uso:
     1. Inicie o servidor: ghl-webhooks
     2. Execute este script: python scripts/test_webhook_integration.py
 """
 
+import asyncio
 import json
-import subprocess
-import time
+
+import httpx
+
+# Servidor local do webhook
+BASE_URL = "http://localhost:8082"
 
 # Emails de teste
 TEST_EMAILS = [
@@ -106,119 +110,96 @@ TEST_EMAILS = [
 ]
 
 
-def send_webhook(payload: dict, test_name: str, expected: str):
-    """Envia payload para webhook local."""
-    print(f"\n{'='*80}")
-    print(f"🧪 Teste: {test_name}")
-    print(f"   Esperado: {expected}")
-    print(f"{'='*80}")
-
-    url = "http://localhost:8082/webhook/InboundMessage"
+async def send_webhook(client: httpx.AsyncClient, test: dict):
+    """Envia o payload de um teste para o webhook local."""
+    return await client.post("/webhook/InboundMessage", json=test["payload"])
 
-    try:
-        # Converter payload para JSON
-        payload_json = json.dumps(payload)
-
-        # Enviar com curl
-        result = subprocess.run(
-            ["curl", "-s", "-X", "POST", url,
-             "-H", "Content-Type: application/json",
-             "-d", payload_json],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
 
-        if result.returncode == 0:
-            print(f"✅ Resposta do webhook:")
-            try:
-                response = json.loads(result.stdout)
-                print(json.dumps(response, indent=2))
-            except:
-                print(result.stdout)
-        else:
-            print(f"❌ Erro ao enviar webhook: {result.stderr}")
+def print_result(test: dict, outcome):
+    """Imprime a resposta (ou o erro) de um teste."""
+    print(f"\n{'='*80}")
+    print(f"🧪 Teste: {test['name']}")
+    print(f"   Esperado: {test['expected']}")
+    print(f"{'='*80}")
 
-    except subprocess.TimeoutExpired:
+    if isinstance(outcome, httpx.TimeoutException):
         print(f"⏱️ Timeout ao enviar webhook")
-    except Exception as e:
-        print(f"❌ Erro: {e}")
-
-    # Aguardar um pouco antes do próximo teste
-    time.sleep(2)
-
-
-def check_server():
-    """Verifica se servidor está rodando."""
+    elif isinstance(outcome, Exception):
+        print(f"❌ Erro: {outcome}")
+    else:
+        print(f"✅ Resposta do webhook:")
+        try:
+            print(json.dumps(outcome.json(), indent=2))
+        except ValueError:
+            print(outcome.text)
+
+
+async def check_server(client: httpx.AsyncClient):
+    """Verifica se servidor está rodando (e se /healthz responde 200)."""
     try:
-        result = subprocess.run(
-            ["curl", "-s", "http://localhost:8082/healthz"],
-            capture_output=True,
-            timeout=5
-        )
-        return result.returncode == 0
-    except:
+        response = await client.get("/healthz", timeout=5)
+    except httpx.HTTPError:
         return False
+    return response.status_code == 200
 
 
-def get_stats():
+async def get_stats(client: httpx.AsyncClient):
     """Busca estatísticas do sistema Two-Pass."""
     print(f"\n{'='*80}")
     print("📊 Estatísticas do Sistema Two-Pass")
     print(f"{'='*80}")
 
     try:
-        result = subprocess.run(
-            ["curl", "-s", "http://localhost:8082/webhook/spam-stats"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-
-        if result.returncode == 0:
-            stats = json.loads(result.stdout)
-            if "two_pass_stats" in stats:
-                s = stats["two_pass_stats"]
-                print(f"\n  Total de emails: {s['total']}")
-                print(f"  Detectados por regras: {s['fast_rules']} ({s['fast_rules_pct']}%)")
-                print(f"  Detectados por GPT: {s['gpt_calls']} ({s['gpt_calls_pct']}%)")
-                print(f"  Economia estimada: {s['estimated_savings_pct']}%")
-                print(f"  Custo sem otimização: {s['cost_without_optimization']}")
-                print(f"  Custo com two-pass: {s['cost_with_two_pass']}")
-                print(f"  Economia: {s['savings']}\n")
-            else:
-                print(json.dumps(stats, indent=2))
+        response = await client.get("/webhook/spam-stats", timeout=5)
+        stats = response.json()
+        if "two_pass_stats" in stats:
+            s = stats["two_pass_stats"]
+            print(f"\n  Total de emails: {s['total']}")
+            print(f"  Detectados por regras: {s['fast_rules']} ({s['fast_rules_pct']}%)")
+            print(f"  Detectados por GPT: {s['gpt_calls']} ({s['gpt_calls_pct']}%)")
+            print(f"  Economia estimada: {s['estimated_savings_pct']}%")
+            print(f"  Custo sem otimização: {s['cost_without_optimization']}")
+            print(f"  Custo com two-pass: {s['cost_with_two_pass']}")
+            print(f"  Economia: {s['savings']}\n")
         else:
-            print(f"❌ Erro ao buscar estatísticas")
+            print(json.dumps(stats, indent=2))
 
+    except httpx.HTTPError:
+        print(f"❌ Erro ao buscar estatísticas")
     except Exception as e:
         print(f"❌ Erro: {e}")
 
 
-def main():
+async def main():
     """Função principal."""
     print("="*80)
     print("🧪 Teste de Integração do Sistema Two-Pass no Webhook")
     print("="*80)
 
-    # Verificar se servidor está rodando
-    if not check_server():
-        print("\n❌ Servidor não está rodando em http://localhost:8082")
-        print("   Inicie o servidor com: ghl-webhooks")
-        return
+    # Uma única conexão keep-alive para todos os testes
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=30) as client:
+        # Verificar se servidor está rodando
+        if not await check_server(client):
+            print(f"\n❌ Servidor não está rodando em {BASE_URL}")
+            print("   Inicie o servidor com: ghl-webhooks")
+            return
 
-    print("\n✅ Servidor está rodando\n")
+        print("\n✅ Servidor está rodando\n")
 
-    # Executar testes
-    for test in TEST_EMAILS:
-        send_webhook(test["payload"], test["name"], test["expected"])
+        # Executar testes em paralelo e imprimir na ordem original
+        outcomes = await asyncio.gather(
+            *(send_webhook(client, test) for test in TEST_EMAILS),
+            return_exceptions=True
+        )
+        for test, outcome in zip(TEST_EMAILS, outcomes):
+            print_result(test, outcome)
 
-    # Buscar estatísticas finais
-    get_stats()
+        # Buscar estatísticas finais
+        await get_stats(client)
 
     print("\n✅ Testes concluídos!")
     print("\nPara ver os logs do servidor, verifique a saída do terminal onde executou 'ghl-webhooks'\n")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -5,7 +5,10 @@ Exposes CLI entry points:
 - ghl-webhooks
 """
 
+from .ttl_cache import TTLCache
+
 __all__ = [
+    "TTLCache",
     "__version__",
 ]
 
@@ -2,15 +2,14 @@ import asyncio
 import json
 import secrets
 import sys
+import time
 import webbrowser
 from dataclasses import dataclass, asdict
-from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
-from urllib.parse import urlencode, parse_qs
+from urllib.parse import urlencode, urlsplit, parse_qs
 
 import httpx
-from aiohttp import web
 
 try:
     from dotenv import load_dotenv  # type: ignore
@@ -52,7 +51,7 @@ class TokenBundle:
     refresh_token: Optional[str]
     scope: Optional[str]
     user_type: Optional[str]
-    expires_at: Optional[str]  # ISO string
+    expires_at: Optional[int]  # Unix epoch (segundos)
     company_id: Optional[str] = None
     location_id: Optional[str] = None
 
@@ -84,7 +83,7 @@ async def exchange_code_for_tokens(
 
     expires_at = None
     if "expires_in" in payload:
-        expires_at = (datetime.utcnow() + timedelta(seconds=int(payload["expires_in"]))).isoformat() + "Z"
+        expires_at = int(time.time()) + int(payload["expires_in"])
 
     return TokenBundle(
         access_token=payload.get("access_token"),
@@ -123,7 +122,7 @@ async def get_location_access_token(
 
     expires_at = None
     if "expires_in" in payload:
-        expires_at = (datetime.utcnow() + timedelta(seconds=int(payload["expires_in"]))).isoformat() + "Z"
+        expires_at = int(time.time()) + int(payload["expires_in"])
 
     return TokenBundle(
         access_token=payload.get("access_token"),
@@ -157,38 +156,60 @@ async def run_oauth_flow(
     loop = asyncio.get_running_loop()
     code_future: asyncio.Future[str] = loop.create_future()
 
-    async def handle_callback(request: web.Request):
-        query = parse_qs(request.query_string)
+    def respond(status: str, text: str, content_type: str = "text/plain") -> bytes:
+        body = text.encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        return head.encode("ascii") + body
+
+    def handle_query(query_string: str) -> bytes:
+        query = parse_qs(query_string)
         state = query.get("state", [None])[0]
         if state != expected_state:
-            return web.Response(text="Invalid state parameter", status=400)
+            return respond("400 Bad Request", "Invalid state parameter")
 
         error = query.get("error", [None])[0]
         if error:
             desc = query.get("error_description", [""])[0]
-            return web.Response(text=f"Authorization failed: {error} - {desc}", status=400)
+            return respond("400 Bad Request", f"Authorization failed: {error} - {desc}")
 
         code = query.get("code", [None])[0]
         if not code:
-            return web.Response(text="Missing authorization code", status=400)
+            return respond("400 Bad Request", "Missing authorization code")
 
         if not code_future.done():
             code_future.set_result(code)
 
-        return web.Response(
-            text=(
+        return respond(
+            "200 OK",
+            (
                 "<html><body><h1>Autorização concluída!</h1>"
                 "<p>Você já pode fechar esta aba.</p></body></html>"
             ),
             content_type="text/html",
         )
 
-    app = web.Application()
-    app.router.add_get("/oauth/callback", handle_callback)
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, "localhost", server_port)
-    await site.start()
+    async def handle_callback(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Servidor mínimo de um único endpoint: lê só a linha de request + headers
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            method, target, _ = head.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+            url = urlsplit(target)
+            if method != "GET" or url.path != "/oauth/callback":
+                writer.write(respond("404 Not Found", "Not Found"))
+            else:
+                writer.write(handle_query(url.query))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_callback, "localhost", server_port)
 
     print(f"↪️  Callback aguardando em: http://localhost:{server_port}/oauth/callback")
     print("🌐 Abrindo o navegador para autorizar o app...")
@@ -203,11 +224,18 @@ async def run_oauth_flow(
 
     async def _cleanup():
         await asyncio.sleep(1.0)
-        await runner.cleanup()
+        server.close()
+        await server.wait_closed()
 
     asyncio.create_task(_cleanup())
 
-    async with httpx.AsyncClient() as client:
+    # Um único cliente (HTTP/2, keep-alive) para as duas trocas de token:
+    # o POST do token da Location reaproveita a conexão TLS da primeira troca
+    async with httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=4),
+    ) as client:
         tokens = await exchange_code_for_tokens(
             client=client,
             code=code,
@@ -216,51 +244,50 @@ async def run_oauth_flow(
             redirect_uri=redirect_uri,
         )
 
-    TOKEN_PATH.parent.mkdir(parents=True, exist_ok=True)
-    TOKEN_PATH.write_text(json.dumps(asdict(tokens), indent=2, ensure_ascii=False))
-    print(f"✅ Tokens salvos em: {TOKEN_PATH.resolve()}")
-
-    print("\n— Resumo (Token atual) —")
-    print("access_token:", (tokens.access_token[:24] + "...") if tokens.access_token else None)
-    print("token_type:", tokens.token_type)
-    print("refresh_token:", (tokens.refresh_token[:24] + "...") if tokens.refresh_token else None)
-    print("user_type:", tokens.user_type)
-    print("company_id:", tokens.company_id)
-    print("location_id:", tokens.location_id)
-    print("scope:", tokens.scope)
-    print("expires_at:", tokens.expires_at)
-
-    try:
-        resp = input("\nDeseja gerar e salvar o token de uma Location agora? (s/n): ").strip().lower()
-        if resp == "s":
-            location_id = input("Informe o ID da Location (subconta): ").strip()
-
-            agency_access_token = tokens.access_token
-            agency_user_type = (tokens.user_type or "").lower()
-
-            company_id = tokens.company_id
-
-            if not company_id:
-                company_id = input("Informe o ID da Company (agência): ").strip()
-
-            if agency_user_type != "company":
-                print("\n⚠️  O token atual não é de Agência (userType=Company).")
-                print("    A API /oauth/locationToken requer um access_token de Agência.")
-                use_manual = input("Quer informar manualmente um access_token de Agência? (s/n): ").strip().lower()
-                if use_manual == "s":
-                    agency_access_token = input("Cole o access_token de Agência (Bearer): ").strip()
-                else:
-                    print("Operação cancelada. Encerrando sem gerar token de Location.")
+        TOKEN_PATH.parent.mkdir(parents=True, exist_ok=True)
+        TOKEN_PATH.write_text(json.dumps(asdict(tokens), indent=2, ensure_ascii=False))
+        print(f"✅ Tokens salvos em: {TOKEN_PATH.resolve()}")
+
+        print("\n— Resumo (Token atual) —")
+        print("access_token:", (tokens.access_token[:24] + "...") if tokens.access_token else None)
+        print("token_type:", tokens.token_type)
+        print("refresh_token:", (tokens.refresh_token[:24] + "...") if tokens.refresh_token else None)
+        print("user_type:", tokens.user_type)
+        print("company_id:", tokens.company_id)
+        print("location_id:", tokens.location_id)
+        print("scope:", tokens.scope)
+        print("expires_at:", tokens.expires_at)
+
+        try:
+            resp = input("\nDeseja gerar e salvar o token de uma Location agora? (s/n): ").strip().lower()
+            if resp == "s":
+                location_id = input("Informe o ID da Location (subconta): ").strip()
+
+                agency_access_token = tokens.access_token
+                agency_user_type = (tokens.user_type or "").lower()
+
+                company_id = tokens.company_id
+
+                if not company_id:
+                    company_id = input("Informe o ID da Company (agência): ").strip()
+
+                if agency_user_type != "company":
+                    print("\n⚠️  O token atual não é de Agência (userType=Company).")
+                    print("    A API /oauth/locationToken requer um access_token de Agência.")
+                    use_manual = input("Quer informar manualmente um access_token de Agência? (s/n): ").strip().lower()
+                    if use_manual == "s":
+                        agency_access_token = input("Cole o access_token de Agência (Bearer): ").strip()
+                    else:
+                        print("Operação cancelada. Encerrando sem gerar token de Location.")
+                        return
+
+                if not company_id:
+                    print("⚠️  companyId não informado. Encerrando sem gerar token de Location.")
                     return
 
-            if not company_id:
-                print("⚠️  companyId não informado. Encerrando sem gerar token de Location.")
-                return
-
-            async with httpx.AsyncClient() as client2:
                 try:
                     loc_tokens = await get_location_access_token(
-                        client=client2,
+                        client=client,
                         agency_access_token=agency_access_token,
                         company_id=company_id,
                         location_id=location_id,
@@ -276,22 +303,22 @@ async def run_oauth_flow(
                         print(body)
                     return
 
-            LOCATION_TOKEN_PATH.parent.mkdir(parents=True, exist_ok=True)
-            LOCATION_TOKEN_PATH.write_text(json.dumps(asdict(loc_tokens), indent=2, ensure_ascii=False))
-            print(f"\n✅ Token da Location salvo em: {LOCATION_TOKEN_PATH.resolve()}")
-
-            print("\n— Resumo (Location) —")
-            print("access_token:", (loc_tokens.access_token[:24] + "...") if loc_tokens.access_token else None)
-            print("token_type:", loc_tokens.token_type)
-            print("refresh_token:", (loc_tokens.refresh_token[:24] + "...") if loc_tokens.refresh_token else None)
-            print("user_type:", loc_tokens.user_type)
-            print("company_id:", loc_tokens.company_id)
-            print("location_id:", loc_tokens.location_id)
-            print("scope:", loc_tokens.scope)
-            print("expires_at:", loc_tokens.expires_at)
-
-    except KeyboardInterrupt:
-        pass
+                LOCATION_TOKEN_PATH.parent.mkdir(parents=True, exist_ok=True)
+                LOCATION_TOKEN_PATH.write_text(json.dumps(asdict(loc_tokens), indent=2, ensure_ascii=False))
+                print(f"\n✅ Token da Location salvo em: {LOCATION_TOKEN_PATH.resolve()}")
+
+                print("\n— Resumo (Location) —")
+                print("access_token:", (loc_tokens.access_token[:24] + "...") if loc_tokens.access_token else None)
+                print("token_type:", loc_tokens.token_type)
+                print("refresh_token:", (loc_tokens.refresh_token[:24] + "...") if loc_tokens.refresh_token else None)
+                print("user_type:", loc_tokens.user_type)
+                print("company_id:", loc_tokens.company_id)
+                print("location_id:", loc_tokens.location_id)
+                print("scope:", loc_tokens.scope)
+                print("expires_at:", loc_tokens.expires_at)
+
+        except KeyboardInterrupt:
+            pass
 
 
 def ask(prompt: str, default: Optional[str] = None, secret: bool = False) -> str:
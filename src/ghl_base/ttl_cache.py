@@ -0,0 +1,69 @@
+"""Cache em memória com expiração (TTL) e despejo LRU.
+
+Usado pela idempotência do servidor de webhooks e pelo cache de
+vereditos do detector two-pass.
+"""
+
+import heapq
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Cache TTL + LRU com memória limitada a O(capacity).
+
+    - LRU: OrderedDict em ordem de acesso; acima de `capacity` sai a chave
+      menos recente.
+    - TTL: min-heap de (expiração, chave); a limpeza só toca nas chaves
+      vencidas. Entradas do heap de chaves regravadas ou despejadas ficam
+      obsoletas e são descartadas ao vencer ou na compactação.
+    - Prazos em ns inteiros de time.monotonic_ns() (imunes a ajustes do relógio).
+    """
+
+    def __init__(self, ttl_seconds: int, capacity: int):
+        self.ttl = ttl_seconds
+        self.capacity = capacity
+        self._ttl_ns = ttl_seconds * 1_000_000_000
+        self._store: "OrderedDict[K, Tuple[int, V]]" = OrderedDict()
+        self._heap: List[Tuple[int, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def _expire(self, now: int):
+        heap = self._heap
+        store = self._store
+        while heap and heap[0][0] <= now:
+            exp, key = heapq.heappop(heap)
+            entry = store.get(key)
+            if entry is not None and entry[0] == exp:
+                del store[key]
+
+    def _compact(self):
+        """Reconstrói o heap só com as entradas vivas (limita o heap a 2x capacity)."""
+        self._heap = [(exp, key) for key, (exp, _) in self._store.items()]
+        heapq.heapify(self._heap)
+
+    def get(self, key: K) -> Optional[V]:
+        """Valor da chave, ou None se ausente/vencida (marca a chave como recente)."""
+        now = time.monotonic_ns()
+        self._expire(now)
+        entry = self._store.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        self._store.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: K, value: V):
+        exp = time.monotonic_ns() + self._ttl_ns
+        self._store[key] = (exp, value)
+        self._store.move_to_end(key)
+        heapq.heappush(self._heap, (exp, key))
+        if len(self._store) > self.capacity:
+            self._store.popitem(last=False)
+        if len(self._heap) > 2 * self.capacity:
+            self._compact()
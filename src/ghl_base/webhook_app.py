@@ -4,13 +4,15 @@ import logging
 import pkgutil
 import hashlib
 import hmac
+import itertools
 import time
-import uuid
 import sys
-from typing import Iterable, List, Tuple, Callable, Any
+from typing import Iterable, List, Optional, Tuple, Callable, Any
 
 from aiohttp import web
 
+from .ttl_cache import TTLCache
+
 try:
     from dotenv import load_dotenv  # type: ignore
     load_dotenv()
@@ -114,123 +116,155 @@ def _collect_routes_and_hooks(modules: Iterable[object]):
     return route_specs, route_tables, middlewares, startups, cleanups
 
 
-@web.middleware
-async def _request_id_logging_middleware(request: web.Request, handler):
-    start = time.time()
-    req_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex
-    request["request_id"] = req_id
+def _constant_time_compare(a: bytes, b: bytes) -> bool:
+    return hmac.compare_digest(a, b)
 
-    try:
-        logging.info("--> %s %s rid=%s", request.method, request.path_qs, req_id)
-        resp: web.StreamResponse = await handler(request)
-        return resp
-    finally:
-        duration = (time.time() - start) * 1000
-        logging.info("<-- %s %s rid=%s %.2fms", request.method, request.path_qs, req_id, duration)
 
+# Configuração HMAC lida uma única vez no import (constante por processo)
+_WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+_SECRET_BYTES = _WEBHOOK_SECRET.encode() if _WEBHOOK_SECRET else None
+_SIG_HEADER = os.getenv("WEBHOOK_SIGNATURE_HEADER", "X-Signature")
+_ALGO = os.getenv("WEBHOOK_SIGNATURE_ALGO", "sha256").lower()
+_DIGESTMOD = {"sha256": hashlib.sha256, "sha1": hashlib.sha1}.get(_ALGO)
+_ALGO_PREFIX = f"{_ALGO}="
 
-def _constant_time_compare(a: str, b: str) -> bool:
-    try:
-        return hmac.compare_digest(a, b)
-    except Exception:
-        if len(a) != len(b):
-            return False
-        result = 0
-        for x, y in zip(a.encode(), b.encode()):
-            result |= x ^ y
-        return result == 0
+# HMAC já com a chave processada; cada requisição parte de um .copy() dele
+_HMAC_TEMPLATE = (
+    hmac.new(_SECRET_BYTES, digestmod=_DIGESTMOD)
+    if _SECRET_BYTES is not None and _DIGESTMOD is not None
+    else None
+)
 
 
-@web.middleware
-async def _signature_middleware(request: web.Request, handler):
-    secret = os.getenv("WEBHOOK_SECRET")
-    if not secret:
-        return await handler(request)
-
-    header_name = os.getenv("WEBHOOK_SIGNATURE_HEADER", "X-Signature")
-    algo = os.getenv("WEBHOOK_SIGNATURE_ALGO", "sha256").lower()
-    provided = request.headers.get(header_name)
+async def _check_signature(request: web.Request) -> Optional[web.StreamResponse]:
+    """Valida a assinatura HMAC do corpo. Retorna a resposta de erro, ou None se ok."""
+    if _SECRET_BYTES is None:
+        return None
+
+    provided = request.headers.get(_SIG_HEADER)
     if not provided:
         return web.Response(status=401, text="missing signature")
 
-    body = await request.read()
-    try:
-        setattr(request, "_read_bytes", body)
-    except Exception:
-        pass
-
-    if algo not in ("sha256", "sha1"):
+    if _DIGESTMOD is None:
         return web.Response(status=400, text="unsupported signature algo")
 
-    digestmod = hashlib.sha256 if algo == "sha256" else hashlib.sha1
-    mac = hmac.new(secret.encode(), body, digestmod=digestmod).hexdigest()
-    if provided.startswith(f"{algo}="):
+    # request.read() aplica o limite client_max_size antes de a assinatura
+    # ser conferida e guarda os bytes em cache: os handlers recebem o mesmo
+    # objeto em request["raw_body"] e em request.read()/text()/json().
+    body = await request.read()
+
+    signer = _HMAC_TEMPLATE.copy()
+    signer.update(body)
+    mac = signer.digest()
+    if provided.startswith(_ALGO_PREFIX):
         provided = provided.split("=", 1)[1]
 
-    if not _constant_time_compare(mac, provided):
+    # Compara os digests crus (assinatura hex inválida = assinatura inválida)
+    try:
+        provided_mac = bytes.fromhex(provided)
+    except ValueError:
         return web.Response(status=401, text="invalid signature")
 
-    request["raw_body"] = body
-    return await handler(request)
-
+    if not _constant_time_compare(mac, provided_mac):
+        return web.Response(status=401, text="invalid signature")
 
-class _TTLMemory:
-    def __init__(self, ttl_seconds: int = 600):
-        self.ttl = ttl_seconds
-        self._store: dict[str, float] = {}
+    request["raw_body"] = body
+    return None
 
-    def seen(self, key: str) -> bool:
-        now = time.time()
-        if len(self._store) > 2048:
-            self._store = {k: exp for k, exp in self._store.items() if exp > now}
-        exp = self._store.get(key)
-        if exp and exp > now:
-            return True
-        return False
 
-    def put(self, key: str):
-        self._store[key] = time.time() + self.ttl
+# Chaves de idempotência já vistas (valor sempre True)
+_idemp_cache: TTLCache[str, bool] = TTLCache(
+    ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600")),
+    capacity=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000")),
+)
 
 
-_idemp_cache = _TTLMemory(ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600")))
+# Configuração de idempotência lida uma única vez no import
+_IDEMP_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+_IDEMP_HEADERS = tuple(
+    h.strip()
+    for h in os.getenv("IDEMPOTENCY_HEADERS", "Idempotency-Key,X-Event-Id").split(",")
+    if h.strip()
+)
 
 
-@web.middleware
-async def _idempotency_middleware(request: web.Request, handler):
-    if os.getenv("IDEMPOTENCY_ENABLED", "true").lower() not in ("1", "true", "yes", "on"):
-        return await handler(request)
+def _check_idempotency(request: web.Request) -> Optional[web.StreamResponse]:
+    """Responde 'duplicate' para chaves de idempotência já vistas; None caso contrário."""
+    if not _IDEMP_ENABLED:
+        return None
 
-    headers_raw = os.getenv("IDEMPOTENCY_HEADERS", "Idempotency-Key,X-Event-Id")
-    header_names = [h.strip() for h in headers_raw.split(",") if h.strip()]
     key = None
-    for name in header_names:
+    for name in _IDEMP_HEADERS:
         key = request.headers.get(name)
         if key:
             break
     if not key:
-        return await handler(request)
+        return None
 
-    if _idemp_cache.seen(key):
+    if _idemp_cache.get(key):
         resp = web.json_response({"status": "duplicate"})
         resp.headers["X-Idempotent-Replayed"] = "true"
         return resp
 
-    _idemp_cache.put(key)
-    return await handler(request)
+    _idemp_cache.put(key, True)
+    return None
+
+
+# Request id local: prefixo aleatório do worker + contador (sem syscall
+# de entropia por requisição, como no uuid4)
+_WORKER_ID = os.urandom(4).hex()
+_REQ_COUNTER = itertools.count()
+
+
+@web.middleware
+async def _webhook_middleware(request: web.Request, handler):
+    """Request id + log de latência, assinatura HMAC e idempotência.
+
+    Uma única camada (em vez de três middlewares encadeados): as verificações
+    rodam em sequência e a primeira que devolver uma resposta encerra a
+    requisição, sem passar pelos hops intermediários da cadeia do aiohttp.
+    """
+    start = time.monotonic_ns()
+    req_id = request.headers.get("X-Request-Id") or f"{_WORKER_ID}-{next(_REQ_COUNTER):x}"
+    request["request_id"] = req_id
+
+    try:
+        logging.info("--> %s %s rid=%s", request.method, request.path_qs, req_id)
+        resp = await _check_signature(request)
+        if resp is None:
+            resp = _check_idempotency(request)
+        if resp is None:
+            resp = await handler(request)
+        return resp
+    finally:
+        duration = (time.monotonic_ns() - start) / 1_000_000
+        logging.info("<-- %s %s rid=%s %.2fms", request.method, request.path_qs, req_id, duration)
+
+
+async def _add_request_id_header(request: web.Request, response: web.StreamResponse):
+    # Sinal on_response_prepare: injeta o request id no início da resposta
+    req_id = request.get("request_id")
+    if req_id and "X-Request-Id" not in response.headers:
+        response.headers["X-Request-Id"] = req_id
 
 
 def build_app():
-    middlewares: List[Callable] = [
-        _request_id_logging_middleware,
-        _signature_middleware,
-        _idempotency_middleware,
-    ]
+    middlewares: List[Callable] = [_webhook_middleware]
 
     modules = _iter_modules_from_env()
     route_specs, route_tables, mod_mws, startups, cleanups = _collect_routes_and_hooks(modules)
+    for mw in mod_mws:
+        # aiohttp>=3.11 memoiza a cadeia (handler + middlewares) por rota, mas
+        # só quando todos os middlewares são new-style (@web.middleware)
+        if getattr(mw, "__middleware_version__", None) != 1:
+            logging.warning(
+                "Middleware %s sem @web.middleware: desativa o cache da cadeia de middlewares",
+                getattr(mw, "__name__", mw),
+            )
     middlewares.extend(mod_mws)
 
     app = web.Application(middlewares=middlewares)
+    app.on_response_prepare.append(_add_request_id_header)
 
     async def _health(_: web.Request):
         return web.Response(text="ok")
@@ -9,32 +9,364 @@ Economia estimada: 60-70% de custos de API
 """
 
 import re
-import json
-from typing import Dict, Any, Optional, Tuple
-from bs4 import BeautifulSoup
+import orjson
+import asyncio
+import hashlib
+from typing import Dict, Any, List, NamedTuple, Optional, Set, Tuple
+import numpy as np
 import logging
 
+from ghl_base.ttl_cache import TTLCache
+
+try:
+    from selectolax.lexbor import LexborHTMLParser  # parser HTML em C (Lexbor)
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    from bs4 import BeautifulSoup  # fallback (e referência de paridade do Lexbor)
+except ImportError:
+    if LexborHTMLParser is None:
+        raise
+    BeautifulSoup = None
+
+try:
+    import ahocorasick  # opcional: varredura Aho-Corasick (pyahocorasick, em C)
+except ImportError:
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
+SPAM_KEYWORDS = (
+    'grátis', 'gratis', 'gratuito', 'free',
+    'clique', 'click', 'urgente', 'urgent',
+    'desconto', 'promoção', 'oferta', 'ganhe',
+    'parabéns', 'congratulations', 'premio', 'prize'
+)
+
+# Uma única varredura do texto para todas as keywords. A regex não acha
+# ocorrências sobrepostas, então cada keyword encontrada também conta as
+# keywords contidas nela ("urgente" implica "urgent"), como no `kw in text`.
+_SPAM_KEYWORDS_RE = re.compile(
+    '(?=(' + '|'.join(map(re.escape, sorted(SPAM_KEYWORDS, key=len, reverse=True))) + '))'
+)
+_KEYWORD_SUBSTRINGS = {
+    kw: frozenset(other for other in SPAM_KEYWORDS if other in kw)
+    for kw in SPAM_KEYWORDS
+}
+
+# Com pyahocorasick: autômato construído uma vez; reporta todas as
+# ocorrências (inclusive sobrepostas) numa única passada
+if ahocorasick is not None:
+    _KEYWORD_AUTOMATON = ahocorasick.Automaton()
+    for _kw in SPAM_KEYWORDS:
+        _KEYWORD_AUTOMATON.add_word(_kw, _kw)
+    _KEYWORD_AUTOMATON.make_automaton()
+    del _kw
+else:
+    _KEYWORD_AUTOMATON = None
+
+
+def _count_spam_keywords(text_lower: str) -> int:
+    """Quantas keywords distintas de SPAM_KEYWORDS aparecem no texto."""
+    if _KEYWORD_AUTOMATON is not None:
+        return len({kw for _, kw in _KEYWORD_AUTOMATON.iter(text_lower)})
+    found = set(_SPAM_KEYWORDS_RE.findall(text_lower))
+    return len(set().union(*(_KEYWORD_SUBSTRINGS[kw] for kw in found)))
+
+# Domínio de um href absoluto (ancorado no início: .match, sem varrer o href)
+_HREF_DOMAIN_RE = re.compile(r'\s*https?://([^/]+)')
+_NON_DIGIT_RE = re.compile(r'[^\d]')
+
+# Anexado ao system prompt nas chamadas em lote: o prompt otimizado pede um
+# único objeto {"is_spam", ...}, que não serve para vários emails
+_BATCH_SYSTEM_SUFFIX = """
+
+# FORMATO DE RESPOSTA EM LOTE
+Quando a mensagem trouxer vários emails (# EMAIL 0, # EMAIL 1, ...), este
+formato substitui o formato de resposta acima. Retorne um único JSON:
+{"results": [{"index": i, "is_spam": bool, "confidence": 0-1, "reason": "explicação", "category": "tipo"}, ...]}
+com um item por email, na mesma ordem."""
+
+# Acima deste tamanho, detect() extrai as features fora do event loop.
+# Fica abaixo do corte de 10000 caracteres do handler de webhook, para que
+# os emails HTML maiores que chegam por lá também saiam do loop.
+_OFFLOAD_BODY_CHARS = 8 * 1024
+
+# Prompt padrão simples (quando nenhum prompt otimizado é fornecido)
+DEFAULT_SYSTEM_PROMPT = """Você é um especialista em detecção de spam.
+Analise o email e retorne JSON: {"is_spam": bool, "confidence": 0-1, "reason": "explicação", "category": "tipo"}"""
+
+
+
+# Tags cujo conteúdo não é texto visível (BeautifulSoup.get_text já as ignora)
+_NON_TEXT_TAGS = ['script', 'style', 'template']
+
+
+def _parse_html_lexbor(body: str) -> Tuple[str, List[str], List[Tuple[Any, Any]]]:
+    """_parse_html com selectolax (Lexbor)."""
+    tree = LexborHTMLParser(body)
+    hrefs = [node.attributes.get('href') or '' for node in tree.css('a[href]')]
+    img_sizes = [
+        (node.attributes.get('width') or '0', node.attributes.get('height') or '0')
+        for node in tree.css('img')
+    ]
+    # CSS/JS dentro do <body> inflariam text_length e o text_preview; o texto
+    # vem da raiz para incluir o <title> do <head>, como no BeautifulSoup
+    tree.strip_tags(_NON_TEXT_TAGS)
+    root = tree.root
+    text = root.text(separator=' ', strip=True) if root is not None else ''
+    return text, hrefs, img_sizes
+
+
+def _parse_html_bs4(body: str) -> Tuple[str, List[str], List[Tuple[Any, Any]]]:
+    """_parse_html com BeautifulSoup (html.parser)."""
+    soup = BeautifulSoup(body, 'html.parser')
+    text = soup.get_text(separator=' ', strip=True)
+    hrefs = [a.get('href', '') for a in soup.find_all('a', href=True)]
+    img_sizes = [(img.get('width', '0'), img.get('height', '0')) for img in soup.find_all('img')]
+    return text, hrefs, img_sizes
+
+
+def _parse_html(body: str) -> Tuple[str, List[str], List[Tuple[Any, Any]]]:
+    """
+    Faz o parse do HTML do email.
+
+    Usa selectolax quando instalado e BeautifulSoup caso contrário; os dois
+    devem produzir as mesmas features (ver scripts/check_html_parity.py).
+
+    Returns:
+        (texto visível, hrefs dos <a href>, (width, height) de cada <img>)
+    """
+    if LexborHTMLParser is not None:
+        return _parse_html_lexbor(body)
+    return _parse_html_bs4(body)
+
+
+class Features(NamedTuple):
+    """Features rápidas de um email (acesso por atributo, sem hashing de dict)."""
+
+    url_count: int
+    img_count: int
+    unique_domains: int
+    tracking_pixel_count: int
+    html_text_ratio: float
+    spam_keyword_count: int
+    caps_ratio: float
+    exclamation_count: int
+    subject: str
+    text_preview: str
+
+
+# Veredito de cada regra: (is_spam, confidence, reason); 0 = nenhuma regra
+_RULE_VERDICTS = {
+    0: (None, None, "Ambíguo - requer análise GPT"),
+    1: (False, 1.0, "DMARC report (regra)"),
+    2: (True, 0.95, "Alto volume URLs + tracking (regra)"),
+    3: (True, 0.92, "Marketing agressivo (regra)"),
+    4: (False, 0.90, "Email limpo sem sinais spam (regra)"),
+    5: (True, 0.88, "HTML pesado + URLs (regra)"),
+    6: (True, 0.85, "Currículo não solicitado (regra)"),
+    7: (True, 0.87, "CAPS excessivo (regra)"),
+}
+_SPAM_RULE_IDS = [rule_id for rule_id, (is_spam, _, _) in _RULE_VERDICTS.items() if is_spam]
+
+
+# Limiares das regras rápidas (fonte única para _rules_numeric e _rule_ids_batch;
+# scripts/check_rule_parity.py confere que os dois caminhos concordam)
+_R2_MIN_URLS = 15            # REGRA 2: url_count > 15 ...
+_R2_MIN_TRACKING = 2         #          ... e tracking pixels > 2
+_R3_MIN_URLS = 10            # REGRA 3: url_count > 10 ...
+_R3_MIN_IMGS = 5             #          ... e imagens > 5 ...
+_R3_MIN_KEYWORDS = 3         #          ... e keywords > 3
+_R5_MIN_HTML_RATIO = 20      # REGRA 5: html/text > 20 ...
+_R5_MIN_URLS = 5             #          ... e url_count > 5
+_R7_MIN_CAPS_RATIO = 0.4     # REGRA 7: caps_ratio > 0.4 ...
+_R7_MIN_PREVIEW_LEN = 50     #          ... e preview > 50 caracteres
+
+
+def _rules_numeric(
+    url_count, img_count, tracking_pixel_count, html_text_ratio,
+    spam_keyword_count, caps_ratio, text_preview_len, is_dmarc, is_cv
+):
+    """Cascata das regras rápidas sobre escalares; retorna o id da regra (0 = ambíguo)."""
+    # REGRA 1: DMARC Reports (27.2% do dataset)
+    if is_dmarc:
+        return 1
+
+    # REGRA 2: Spam óbvio - Muitas URLs + tracking pixels
+    if url_count > _R2_MIN_URLS and tracking_pixel_count > _R2_MIN_TRACKING:
+        return 2
+
+    # REGRA 3: Marketing agressivo - URLs + imagens + keywords
+    if url_count > _R3_MIN_URLS and img_count > _R3_MIN_IMGS and spam_keyword_count > _R3_MIN_KEYWORDS:
+        return 3
+
+    # REGRA 4: Legítimo óbvio - Sem URLs, sem keywords spam
+    if url_count == 0 and spam_keyword_count == 0 and tracking_pixel_count == 0:
+        return 4
+
+    # REGRA 5: HTML excessivo (típico de spam)
+    if html_text_ratio > _R5_MIN_HTML_RATIO and url_count > _R5_MIN_URLS:
+        return 5
+
+    # REGRA 6: Currículos - Subject pattern
+    if is_cv:
+        return 6
+
+    # REGRA 7: CAPS excessivo (spam)
+    if caps_ratio > _R7_MIN_CAPS_RATIO and text_preview_len > _R7_MIN_PREVIEW_LEN:
+        return 7
+
+    # NÃO CONCLUSIVO - precisa GPT
+    return 0
+
+
+def _subject_flags(subject: str) -> Tuple[bool, bool]:
+    """Regras de subject: (é relatório DMARC, é currículo)."""
+    subject = subject.lower()
+    return (
+        'report domain:' in subject or 'dmarc' in subject,
+        'currículo' in subject or 'curriculo' in subject or 'cv ' in subject,
+    )
+
+
+def _rule_id(features: Features) -> int:
+    """Id da regra conclusiva para um email (0 = ambíguo)."""
+    is_dmarc, is_cv = _subject_flags(features.subject)
+    return _rules_numeric(
+        features.url_count,
+        features.img_count,
+        features.tracking_pixel_count,
+        features.html_text_ratio,
+        features.spam_keyword_count,
+        features.caps_ratio,
+        len(features.text_preview),
+        is_dmarc,
+        is_cv,
+    )
+
+
+def _rule_ids_batch(features: List[Features]) -> np.ndarray:
+    """_rule_id vetorizado: uma coluna NumPy por feature e np.select na ordem das regras."""
+    (url_count, img_count, tracking_pixels, html_text_ratio,
+     spam_keyword_count, caps_ratio, preview_len) = np.array(
+        [
+            (f.url_count, f.img_count, f.tracking_pixel_count, f.html_text_ratio,
+             f.spam_keyword_count, f.caps_ratio, len(f.text_preview))
+            for f in features
+        ],
+        dtype=np.float64
+    ).reshape(-1, 7).T
+
+    flags = np.array([_subject_flags(f.subject) for f in features], dtype=bool).reshape(-1, 2)
+    is_dmarc, is_cv = flags[:, 0], flags[:, 1]
+
+    # Mesma ordem de prioridade de _rules_numeric (REGRA 1..7)
+    conditions = [
+        is_dmarc,
+        (url_count > _R2_MIN_URLS) & (tracking_pixels > _R2_MIN_TRACKING),
+        (url_count > _R3_MIN_URLS) & (img_count > _R3_MIN_IMGS) & (spam_keyword_count > _R3_MIN_KEYWORDS),
+        (url_count == 0) & (spam_keyword_count == 0) & (tracking_pixels == 0),
+        (html_text_ratio > _R5_MIN_HTML_RATIO) & (url_count > _R5_MIN_URLS),
+        is_cv,
+        (caps_ratio > _R7_MIN_CAPS_RATIO) & (preview_len > _R7_MIN_PREVIEW_LEN),
+    ]
+    return np.select(conditions, list(range(1, 8)), default=0)
+
+
+class BatchClassification(NamedTuple):
+    """Resultado da 1ª passagem em lote (arrays alinhados com a entrada)."""
+    is_spam: np.ndarray      # bool; False também para os ambíguos
+    needs_gpt: np.ndarray    # bool; nenhuma regra conclusiva
+    rule_ids: np.ndarray     # id da regra em _RULE_VERDICTS (0 = ambíguo)
+    features: List[Features]
+
+    def result(self, i: int) -> Dict[str, Any]:
+        """Resultado do email i no mesmo formato de fast_rules_only."""
+        is_spam, confidence, reason = _RULE_VERDICTS[int(self.rule_ids[i])]
+        return {
+            "is_spam": is_spam,
+            "confidence": confidence,
+            "reason": reason,
+            "method": "fast_rule" if is_spam is not None else None,
+            "features": self.features[i]
+        }
+
+
+def _verdict_key(body: str, subject: str) -> bytes:
+    """Chave do cache de vereditos GPT: SHA-256 de (subject, início do body)."""
+    return hashlib.sha256((subject + '\n' + body[:2000]).encode()).digest()
+
 
 class TwoPassSpamDetector:
     """Detector de spam com sistema two-pass."""
 
-    def __init__(self, openai_client=None):
+    def __init__(
+        self,
+        openai_client=None,
+        gpt_batch_size: int = 1,
+        gpt_batch_window: float = 0.05,
+        gpt_max_inflight: int = 4,
+        verdict_cache_ttl: int = 86400,
+        verdict_cache_size: int = 10000
+    ):
         """
         Inicializa detector.
 
         Args:
             openai_client: Cliente OpenAI async (opcional, para 2ª passagem)
+            gpt_batch_size: Máximo de emails ambíguos agrupados numa chamada
+                GPT (padrão 1: sem agrupamento; ex.: 8 para backfills)
+            gpt_batch_window: Janela (segundos) para juntar emails num lote
+            gpt_max_inflight: Máximo de chamadas GPT simultâneas do agrupador
+            verdict_cache_ttl: Validade (segundos) dos vereditos GPT em cache
+            verdict_cache_size: Máximo de vereditos GPT em cache
         """
         self.openai_client = openai_client
         self.stats = {
             "total": 0,
             "fast_rules": 0,
-            "gpt_calls": 0
+            "gpt_calls": 0,
+            "cache_hits": 0
         }
 
-    def extract_features(self, body: str, subject: str = "") -> Dict[str, Any]:
+        # Vereditos GPT por hash de (subject, início do body): campanhas
+        # repetidas não voltam ao GPT
+        self._verdict_cache: TTLCache[bytes, Dict[str, Any]] = TTLCache(verdict_cache_ttl, verdict_cache_size)
+        # Singleflight: chamadas GPT em andamento por chave do cache; cópias
+        # simultâneas do mesmo email aguardam o mesmo resultado
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+
+        # Micro-batcher da 2ª passagem: (body, features, prompt, future)
+        self.gpt_batch_size = gpt_batch_size
+        self.gpt_batch_window = gpt_batch_window
+        self._pending: List[Tuple[str, Features, str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._gpt_semaphore = asyncio.Semaphore(gpt_max_inflight)
+        self._batch_tasks: Set[asyncio.Task] = set()
+
+    async def warmup(self):
+        """
+        Aquece o detector antes do uso (não conta nas estatísticas).
+
+        Exercita a extração de features e as regras uma vez (parser HTML,
+        cache de regex do módulo re) e, se houver cliente OpenAI, abre a
+        conexão TLS com uma chamada leve (models.list).
+        """
+        features = self.extract_features(
+            '<p>warmup <a href="https://example.com">x</a><img width="1" height="1"></p>',
+            "warmup"
+        )
+        self.apply_fast_rules(features)
+
+        if self.openai_client:
+            try:
+                await self.openai_client.models.list()
+            except Exception as e:
+                logger.warning(f"Warmup da OpenAI falhou: {e}")
+
+    def extract_features(self, body: str, subject: str = "") -> Features:
         """
         Extrai features rápidas do email.
 
@@ -43,35 +375,29 @@ class TwoPassSpamDetector:
             subject: Subject do email
 
         Returns:
-            Dict com features calculadas
+            Features calculadas
         """
-        soup = BeautifulSoup(body, 'html.parser')
-        text = soup.get_text(separator=' ', strip=True)
+        text, hrefs, img_sizes = _parse_html(body)
 
         # URLs
-        urls = soup.find_all('a', href=True)
-        url_count = len(urls)
+        url_count = len(hrefs)
 
         # Extrair domínios únicos
-        domains = []
-        for url in urls:
-            href = url.get('href', '')
-            matches = re.findall(r'https?://([^/]+)', href)
-            if matches:
-                domains.append(matches[0])
-        unique_domains = len(set(domains))
+        domains = set()
+        for href in hrefs:
+            match = _HREF_DOMAIN_RE.match(href)
+            if match:
+                domains.add(match.group(1))
+        unique_domains = len(domains)
 
         # Imagens
-        imgs = soup.find_all('img')
-        img_count = len(imgs)
+        img_count = len(img_sizes)
 
         # Tracking pixels (1x1 images)
         tracking_pixels = 0
-        for img in imgs:
-            width = img.get('width', '0')
-            height = img.get('height', '0')
-            w = int(re.sub(r'[^\d]', '', str(width)) or '0')
-            h = int(re.sub(r'[^\d]', '', str(height)) or '0')
+        for width, height in img_sizes:
+            w = int(_NON_DIGIT_RE.sub('', str(width)) or '0')
+            h = int(_NON_DIGIT_RE.sub('', str(height)) or '0')
             if w <= 1 and h <= 1:
                 tracking_pixels += 1
 
@@ -80,43 +406,43 @@ class TwoPassSpamDetector:
         text_length = len(text)
         html_text_ratio = html_length / max(text_length, 1)
 
-        # Keywords spam
-        spam_keywords = [
-            'grátis', 'gratis', 'gratuito', 'free',
-            'clique', 'click', 'urgente', 'urgent',
-            'desconto', 'promoção', 'oferta', 'ganhe',
-            'parabéns', 'congratulations', 'premio', 'prize'
-        ]
-        text_lower = text.lower()
-        spam_keyword_count = sum(1 for kw in spam_keywords if kw in text_lower)
-
-        # CAPS ratio
-        caps_count = sum(1 for c in text if c.isupper())
+        # Keywords spam (quantas keywords distintas aparecem no texto)
+        spam_keyword_count = _count_spam_keywords(text.lower())
+
+        # CAPS ratio (maiúsculas ASCII + Latin-1, vetorizado sobre os code points)
+        codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        caps_count = int(np.count_nonzero(
+            ((codepoints >= 0x41) & (codepoints <= 0x5A)) |
+            ((codepoints >= 0xC0) & (codepoints <= 0xDE) & (codepoints != 0xD7))
+        ))
         caps_ratio = caps_count / max(len(text), 1)
 
         # Exclamações
         exclamation_count = text.count('!')
 
-        return {
-            'url_count': url_count,
-            'img_count': img_count,
-            'unique_domains': unique_domains,
-            'tracking_pixel_count': tracking_pixels,
-            'html_text_ratio': html_text_ratio,
-            'spam_keyword_count': spam_keyword_count,
-            'caps_ratio': caps_ratio,
-            'exclamation_count': exclamation_count,
-            'subject': subject,
-            'text_preview': text[:200]
-        }
+        return Features(
+            url_count=url_count,
+            img_count=img_count,
+            unique_domains=unique_domains,
+            tracking_pixel_count=tracking_pixels,
+            html_text_ratio=html_text_ratio,
+            spam_keyword_count=spam_keyword_count,
+            caps_ratio=caps_ratio,
+            exclamation_count=exclamation_count,
+            subject=subject,
+            text_preview=text[:200]
+        )
 
     def apply_fast_rules(
         self,
-        features: Dict[str, Any]
+        features: Features
     ) -> Tuple[Optional[bool], Optional[float], str]:
         """
         Aplica regras rápidas de detecção.
 
+        As regras de subject são avaliadas aqui; a cascata numérica roda em
+        _rules_numeric (em lote, use classify_batch).
+
         Args:
             features: Features extraídas do email
 
@@ -124,52 +450,79 @@ class TwoPassSpamDetector:
             Tuple (is_spam, confidence, reason)
             - None se não conclusivo (precisa 2ª passagem)
         """
-        subject = features.get('subject', '').lower()
+        return _RULE_VERDICTS[_rule_id(features)]
 
-        # REGRA 1: DMARC Reports (27.2% do dataset)
-        if 'report domain:' in subject or 'dmarc' in subject:
-            return False, 1.0, "DMARC report (regra)"
+    def classify_batch(self, bodies: List[str], subjects: List[str]) -> BatchClassification:
+        """
+        Executa a 1ª passagem para vários emails de uma vez.
 
-        # REGRA 2: Spam óbvio - Muitas URLs + tracking pixels
-        if features['url_count'] > 15 and features['tracking_pixel_count'] > 2:
-            return True, 0.95, "Alto volume URLs + tracking (regra)"
+        As features viram colunas NumPy (uma por feature) e a cascata de
+        regras é avaliada com máscaras vetorizadas; np.select mantém a
+        prioridade das regras de apply_fast_rules.
 
-        # REGRA 3: Marketing agressivo - URLs + imagens + keywords
-        if (features['url_count'] > 10 and
-            features['img_count'] > 5 and
-            features['spam_keyword_count'] > 3):
-            return True, 0.92, "Marketing agressivo (regra)"
+        Args:
+            bodies: Corpos dos emails
+            subjects: Subjects dos emails (mesma ordem de bodies)
 
-        # REGRA 4: Legítimo óbvio - Sem URLs, sem keywords spam
-        if (features['url_count'] == 0 and
-            features['spam_keyword_count'] == 0 and
-            features['tracking_pixel_count'] == 0):
-            return False, 0.90, "Email limpo sem sinais spam (regra)"
+        Returns:
+            BatchClassification com as máscaras is_spam e needs_gpt
+        """
+        features = [self.extract_features(body, subject) for body, subject in zip(bodies, subjects)]
 
-        # REGRA 5: HTML excessivo (típico de spam)
-        if features['html_text_ratio'] > 20 and features['url_count'] > 5:
-            return True, 0.88, "HTML pesado + URLs (regra)"
+        rule_ids = _rule_ids_batch(features)
+        is_spam = np.isin(rule_ids, _SPAM_RULE_IDS)
+        needs_gpt = rule_ids == 0
 
-        # REGRA 6: Currículos - Subject pattern
-        if 'currículo' in subject or 'curriculo' in subject or 'cv ' in subject:
-            return True, 0.85, "Currículo não solicitado (regra)"
+        self.stats['total'] += len(features)
+        self.stats['fast_rules'] += int(np.count_nonzero(~needs_gpt))
 
-        # REGRA 7: CAPS excessivo (spam)
-        if features['caps_ratio'] > 0.4 and len(features['text_preview']) > 50:
-            return True, 0.87, "CAPS excessivo (regra)"
+        return BatchClassification(is_spam, needs_gpt, rule_ids, features)
 
-        # NÃO CONCLUSIVO - precisa GPT
-        return None, None, "Ambíguo - requer análise GPT"
+    def _format_email(self, body: str, features: Features) -> str:
+        """Formata subject, início do body e features de um email para o prompt GPT."""
+        body_preview = body[:1000] if len(body) > 1000 else body
+
+        return f"""
+**Subject:** {features.subject}
+
+**Body (início):**
+{body_preview}...
+
+## FEATURES CALCULADAS
+
+- **URLs**: {features.url_count}
+- **Imagens**: {features.img_count}
+- **HTML/Text Ratio**: {features.html_text_ratio:.2f}
+- **Domínios únicos**: {features.unique_domains}
+- **Tracking pixels**: {features.tracking_pixel_count}
+- **Keywords spam**: {features.spam_keyword_count}
+- **CAPS ratio**: {features.caps_ratio:.2f}
+- **Exclamações**: {features.exclamation_count}
+"""
+
+    def _strip_markdown(self, result_text: str) -> str:
+        """Remove cercas de markdown (```json ... ```) da resposta do GPT."""
+        return (
+            result_text.strip()
+            .removeprefix('```json')
+            .removeprefix('```')
+            .removesuffix('```')
+            .strip()
+        )
 
     async def detect_with_gpt(
         self,
         body: str,
-        features: Dict[str, Any],
+        features: Features,
         system_prompt: str
     ) -> Dict[str, Any]:
         """
         Detecção usando GPT-4o-mini (2ª passagem).
 
+        Emails que chegam dentro de gpt_batch_window (até gpt_batch_size)
+        são agrupados numa única chamada GPT; cada chamador aguarda só o
+        próprio veredito.
+
         Args:
             body: Corpo do email
             features: Features calculadas
@@ -188,32 +541,77 @@ class TwoPassSpamDetector:
                 "method": "fallback"
             }
 
-        # Preparar prompt com features
-        body_preview = body[:1000] if len(body) > 1000 else body
+        if self.gpt_batch_size <= 1:
+            return await self._gpt_single(body, features, system_prompt)
 
-        analysis_prompt = f"""
-# EMAIL PARA ANÁLISE
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((body, features, system_prompt, future))
 
-**Subject:** {features['subject']}
+        if len(self._pending) >= self.gpt_batch_size:
+            self._flush_pending()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.gpt_batch_window, self._flush_pending)
 
-**Body (início):**
-{body_preview}...
+        return await future
 
-## FEATURES CALCULADAS
+    def _flush_pending(self):
+        """Despacha os emails enfileirados em lotes (um lote por prompt)."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
 
-- **URLs**: {features['url_count']}
-- **Imagens**: {features['img_count']}
-- **HTML/Text Ratio**: {features['html_text_ratio']:.2f}
-- **Domínios únicos**: {features['unique_domains']}
-- **Tracking pixels**: {features['tracking_pixel_count']}
-- **Keywords spam**: {features['spam_keyword_count']}
-- **CAPS ratio**: {features['caps_ratio']:.2f}
-- **Exclamações**: {features['exclamation_count']}
+        pending, self._pending = self._pending, []
 
+        by_prompt: Dict[str, List[Tuple[str, Features, str, asyncio.Future]]] = {}
+        for item in pending:
+            by_prompt.setdefault(item[2], []).append(item)
+
+        for items in by_prompt.values():
+            for start in range(0, len(items), self.gpt_batch_size):
+                task = asyncio.create_task(self._run_gpt_batch(items[start:start + self.gpt_batch_size]))
+                self._batch_tasks.add(task)
+                task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_gpt_batch(self, items: List[Tuple[str, Features, str, asyncio.Future]]):
+        """Executa um lote do micro-batcher e resolve o future de cada email."""
+        try:
+            async with self._gpt_semaphore:
+                if len(items) == 1:
+                    body, features, system_prompt, _ = items[0]
+                    results = [await self._gpt_single(body, features, system_prompt)]
+                else:
+                    results = await self._gpt_batch(
+                        [(body, features) for body, features, _, _ in items],
+                        items[0][2]
+                    )
+        except BaseException as e:
+            for *_, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+
+        for (*_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _gpt_single(
+        self,
+        body: str,
+        features: Features,
+        system_prompt: str
+    ) -> Dict[str, Any]:
+        """Chamada GPT para um único email."""
+        # Preparar prompt com features
+        analysis_prompt = f"""
+# EMAIL PARA ANÁLISE
+{self._format_email(body, features)}
 Analise este email e retorne APENAS o JSON (sem markdown):
 """
 
         try:
+            # Prompt fixo sempre como 1ª mensagem: prefixo idêntico entre
+            # chamadas aproveita o prompt caching automático da OpenAI
             response = await self.openai_client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
@@ -227,10 +625,9 @@ Analise este email e retorne APENAS o JSON (sem markdown):
             result_text = response.choices[0].message.content
 
             # Remover markdown se presente
-            if result_text.startswith('```'):
-                result_text = re.sub(r'^```(?:json)?\s*|\s*```$', '', result_text, flags=re.MULTILINE)
+            result_text = self._strip_markdown(result_text)
 
-            result = json.loads(result_text)
+            result = orjson.loads(result_text)
             result['method'] = 'gpt'
             return result
 
@@ -244,6 +641,155 @@ Analise este email e retorne APENAS o JSON (sem markdown):
                 "method": "error"
             }
 
+    async def detect_batch_with_gpt(
+        self,
+        emails: List[Tuple[str, Features]],
+        system_prompt: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Detecção de vários emails ambíguos numa única chamada GPT.
+
+        O system prompt vai uma vez só por lote, em vez de uma vez por email.
+
+        Args:
+            emails: Lista de (body, features) já analisados pelas regras
+            system_prompt: Prompt otimizado
+
+        Returns:
+            Lista de dicts (is_spam, confidence, reason, category), na mesma
+            ordem de emails
+        """
+        if not emails:
+            return []
+
+        self.stats['gpt_calls'] += len(emails)
+
+        if not self.openai_client:
+            logger.warning("OpenAI client não configurado, assumindo não-spam")
+            return [{
+                "is_spam": False,
+                "confidence": 0.5,
+                "reason": "OpenAI não disponível",
+                "category": "unknown",
+                "method": "fallback"
+            } for _ in emails]
+
+        return await self._gpt_batch(emails, system_prompt)
+
+    async def _gpt_batch(
+        self,
+        emails: List[Tuple[str, Features]],
+        system_prompt: str
+    ) -> List[Dict[str, Any]]:
+        """Chamada GPT para vários emails; um resultado por email, na mesma ordem."""
+        sections = "".join(
+            f"\n# EMAIL {i}\n{self._format_email(body, features)}"
+            for i, (body, features) in enumerate(emails)
+        )
+        analysis_prompt = f"""{sections}
+Analise os {len(emails)} emails acima e retorne APENAS o JSON (sem markdown) no formato
+{{"results": [...]}}, com exatamente {len(emails)} itens. O item i corresponde ao EMAIL i:
+{{"index": i, "is_spam": bool, "confidence": 0-1, "reason": "explicação", "category": "tipo"}}
+"""
+
+        try:
+            # Prompt fixo continua sendo o prefixo da 1ª mensagem (prompt caching)
+            response = await self.openai_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": system_prompt + _BATCH_SYSTEM_SUFFIX},
+                    {"role": "user", "content": analysis_prompt}
+                ],
+                temperature=0.3,
+                response_format={"type": "json_object"}
+            )
+        except Exception as e:
+            logger.error(f"Erro na API OpenAI: {e}", exc_info=True)
+            return [{
+                "is_spam": False,
+                "confidence": 0.5,
+                "reason": f"Erro GPT: {str(e)}",
+                "category": "error",
+                "method": "error"
+            } for _ in emails]
+
+        try:
+            result_text = self._strip_markdown(response.choices[0].message.content)
+            items = orjson.loads(result_text).get("results")
+        except Exception as e:
+            logger.warning(f"Resposta do lote inválida ({e}), refazendo emails individualmente")
+            items = None
+        if not isinstance(items, list):
+            items = []
+
+        # "index" vem do modelo: só vale se for um int dentro do lote
+        # (bool é int em Python, mas não é um índice válido)
+        by_index = {}
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            index = item.get("index", position)
+            if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < len(emails):
+                index = position
+            by_index.setdefault(index, item)
+
+        results: List[Optional[Dict[str, Any]]] = []
+        missing = []
+        for i in range(len(emails)):
+            item = by_index.get(i)
+            if item is None:
+                missing.append(i)
+                results.append(None)
+                continue
+            item.pop("index", None)
+            item['method'] = 'gpt'
+            results.append(item)
+
+        # Itens ausentes (ex.: modelo respondeu no formato de email único)
+        # voltam para a chamada individual em vez de virar "não-spam"
+        if missing:
+            logger.warning(f"Lote GPT sem {len(missing)}/{len(emails)} itens, refazendo individualmente")
+            singles = await asyncio.gather(*(
+                self._gpt_single(emails[i][0], emails[i][1], system_prompt)
+                for i in missing
+            ))
+            for i, result in zip(missing, singles):
+                results[i] = result
+
+        return results
+
+    def fast_rules_only(self, body: str, subject: str = "") -> Dict[str, Any]:
+        """
+        Executa apenas a 1ª passagem (regras rápidas).
+
+        Args:
+            body: Corpo do email
+            subject: Subject do email
+
+        Returns:
+            Dict com is_spam, confidence, reason, method e features.
+            method é "fast_rule" se as regras foram conclusivas, ou None se
+            o email é ambíguo (is_spam None, requer 2ª passagem)
+        """
+        return self._first_pass(self.extract_features(body, subject))
+
+    def _first_pass(self, features: Features) -> Dict[str, Any]:
+        """Aplica as regras rápidas sobre features já extraídas (ver fast_rules_only)."""
+        self.stats['total'] += 1
+
+        is_spam, confidence, reason = self.apply_fast_rules(features)
+
+        if is_spam is not None:
+            self.stats['fast_rules'] += 1
+
+        return {
+            "is_spam": is_spam,
+            "confidence": confidence,
+            "reason": reason,
+            "method": "fast_rule" if is_spam is not None else None,
+            "features": features
+        }
+
     async def detect(
         self,
         body: str,
@@ -261,40 +807,91 @@ Analise este email e retorne APENAS o JSON (sem markdown):
         Returns:
             Dict com is_spam, confidence, reason, method
         """
-        self.stats['total'] += 1
-
-        # Extrair features
-        features = self.extract_features(body, subject)
-
-        # 1ª PASSAGEM - Regras rápidas
-        is_spam, confidence, reason = self.apply_fast_rules(features)
-
-        if is_spam is not None:
+        # 1ª PASSAGEM - Regras rápidas. Corpos grandes são parseados numa
+        # thread para não bloquear o event loop (os demais webhooks)
+        if len(body) > _OFFLOAD_BODY_CHARS:
+            features = await asyncio.to_thread(self.extract_features, body, subject)
+        else:
+            features = self.extract_features(body, subject)
+        first_pass = self._first_pass(features)
+        features = first_pass["features"]
+        reason = first_pass["reason"]
+
+        if first_pass["method"] == "fast_rule":
             # Conclusivo com regras
-            self.stats['fast_rules'] += 1
             logger.info(f"✅ Detectado por REGRA: {reason}")
-            return {
-                "is_spam": is_spam,
-                "confidence": confidence,
-                "reason": reason,
-                "method": "fast_rule",
-                "features": features
-            }
+            return first_pass
+
+        # 2ª PASSAGEM - GPT para casos ambíguos (ou veredito já em cache)
+        cache_key = _verdict_key(body, subject)
+        cached = self._verdict_cache.get(cache_key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            logger.info(f"♻️ Veredito GPT em cache (Razão: {reason})")
+            cached = dict(cached)
+            cached['features'] = features
+            return cached
+
+        while cache_key in self._inflight:
+            # Mesmo email já está no GPT: aguarda o resultado em vez de repetir
+            inflight = self._inflight[cache_key]
+            logger.info(f"♻️ Aguardando chamada GPT em andamento (Razão: {reason})")
+            try:
+                shared = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise  # este chamador é que foi cancelado
+                # A requisição que fazia a chamada foi cancelada: refaz aqui
+                continue
+            self.stats['cache_hits'] += 1
+            gpt_result = dict(shared)
+            gpt_result['features'] = features
+            return gpt_result
 
-        # 2ª PASSAGEM - GPT para casos ambíguos
         self.stats['gpt_calls'] += 1
         logger.info(f"🤖 Caso ambíguo, chamando GPT... (Razão: {reason})")
 
         if not system_prompt:
-            # Prompt padrão simples
-            system_prompt = """Você é um especialista em detecção de spam.
-Analise o email e retorne JSON: {"is_spam": bool, "confidence": 0-1, "reason": "explicação", "category": "tipo"}"""
+            system_prompt = DEFAULT_SYSTEM_PROMPT
 
-        gpt_result = await self.detect_with_gpt(body, features, system_prompt)
+        inflight = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = inflight
+        try:
+            gpt_result = await self.detect_with_gpt(body, features, system_prompt)
+            inflight.set_result(dict(gpt_result))
+        except asyncio.CancelledError:
+            # Só esta requisição foi cancelada; quem aguarda refaz a chamada
+            inflight.cancel()
+            raise
+        except BaseException as e:
+            inflight.set_exception(e)
+            inflight.exception()  # marca como lida (pode não haver quem aguarde)
+            raise
+        finally:
+            if self._inflight.get(cache_key) is inflight:
+                del self._inflight[cache_key]
+
+        if gpt_result.get('method') == 'gpt':
+            # Erros e fallbacks não entram no cache
+            self._verdict_cache.put(cache_key, dict(gpt_result))
         gpt_result['features'] = features
 
         return gpt_result
 
+    def record_verdict(self, result: Dict[str, Any]):
+        """
+        Contabiliza um email decidido fora do detector: pré-filtro do
+        chamador ou veredito reaproveitado de um email idêntico.
+
+        Conta no total; regras contam como fast_rules e vereditos GPT
+        reaproveitados como cache_hits (nenhuma chamada GPT nova).
+        """
+        self.stats['total'] += 1
+        if result.get('method') == 'fast_rule':
+            self.stats['fast_rules'] += 1
+        elif result.get('method') == 'gpt':
+            self.stats['cache_hits'] += 1
+
     def get_stats(self) -> Dict[str, Any]:
         """Retorna estatísticas de uso."""
         total = self.stats['total']
@@ -318,6 +915,7 @@ Analise o email e retorne JSON: {"is_spam": bool, "confidence": 0-1, "reason": "
             "total": total,
             "fast_rules": self.stats['fast_rules'],
             "gpt_calls": self.stats['gpt_calls'],
+            "cache_hits": self.stats['cache_hits'],
             "fast_rules_pct": round(fast_pct, 1),
             "gpt_calls_pct": round(gpt_pct, 1),
             "estimated_savings_pct": round(savings_pct, 1),